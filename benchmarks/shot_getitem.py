@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# This file is part of postexperiment.
+#
+# postexperiment is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# postexperiment is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with postexperiment. If not, see <http://www.gnu.org/licenses/>.
+'''
+Microbenchmark of the key lookup of `Shot`, which is called for every name
+of an expression evaluated by `Shot.__call__`.
+
+`ReferenceShot` implements the lookup as it used to be: alias, membership test,
+`getattr` for diagnostics and `isinstance` for `LazyAccess` on every access.
+
+Usage: python benchmarks/shot_getitem.py
+'''
+
+import timeit
+
+import postexperiment as pe
+from postexperiment import common
+from postexperiment.datasources import LazyAccess
+
+
+class ReferenceShot(pe.Shot):
+    __slots__ = []
+
+    def __getitem__(self, key):
+        if key == 'self':
+            return self
+        if key in self.alias:
+            return self[self.alias[key]]
+        if key in self:
+            ret = self._mapping[key]
+        else:
+            ret = getattr(self, key)
+        if isinstance(ret, LazyAccess):
+            ret = ret.access(self, key)
+        return ret
+
+    def __getattr__(self, key):
+        if key.startswith('_'):
+            raise AttributeError
+        diagnostic = self.diagnostics[key]
+
+        def call(*args, context=None, **kwargs):
+            if context is None:
+                context = common.DefaultContext()
+            context['shot'] = self
+            return diagnostic(self, *args, context=context, **kwargs)
+        return call
+
+    def __call__(self, expr):
+        return eval(compile(expr, '<string>', 'eval'), {}, self)
+
+
+def benchdiag(shot):
+    return 1.0
+
+
+def main(number=100000):
+    pe.Shot._register_diagnostic_fromdict({'benchdiag': benchdiag})
+    pe.Shot.alias['energy'] = 'e'
+    data = dict(id=1, a=1.0, b=2.0, c=3.0, e=4.0)
+    cases = [('plain key', "shot['a']"),
+             ('alias', "shot['energy']"),
+             ('diagnostic', "shot['benchdiag']()"),
+             ('expression', "shot('a + b * c + energy')")]
+    print('{:<12} {:>12} {:>12} {:>8}'.format('', 'reference', 'Shot', 'speedup'))
+    for name, stmt in cases:
+        times = []
+        for cls in (ReferenceShot, pe.Shot):
+            shot = cls(data)
+            t = min(timeit.repeat(stmt, globals=dict(shot=shot), number=number, repeat=3))
+            times.append(t / number * 1e9)
+        s = '{:<12} {:>9.0f} ns {:>9.0f} ns {:>7.2f}x'
+        print(s.format(name, times[0], times[1], times[0] / times[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -28,6 +28,8 @@ from .common import *
 from .algorithms import *
 from .datasources import *
 from .cache import *
+from .reductions import *
+from .parallel import *
 
 from ._version import get_versions
 __version__ = get_versions()['version']
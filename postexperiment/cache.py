@@ -19,6 +19,7 @@ decorators for function caching.
 Stephan Kuschel, 2018
 '''
 
+import io
 import os
 import sys
 import functools
@@ -26,8 +27,18 @@ import time
 import pickle
 import socket
 import glob
+import types
+import hashlib
+import atexit
+import itertools
+import threading
+import collections
+import numpy as np
 
-__all__ = ['permanentcachedecorator']
+from . import common
+from . import parallel
+
+__all__ = ['permanentcachedecorator', 'MemoCache']
 
 
 class permanentcachedecorator():
@@ -37,7 +48,7 @@ class permanentcachedecorator():
     Stephan Kuschel, 2018
     '''
 
-    def __init__(self, file, ShotId):
+    def __init__(self, file, ShotId, **kwargs):
         '''
         returns a decorater.
 
@@ -48,12 +59,17 @@ class permanentcachedecorator():
           ShotId: callable
             A callable mapping from a `Shot` to a hasable object to identify
             identical shots, even between python sessions!
+
+        kwargs
+        ------
+          are passed to the cache of every decorated function. See `_PermanentCache`.
         '''
         self.file = file
         self.ShotId = ShotId
+        self.kwargs = kwargs
 
     def __call__(self, function):
-        ret = _PermanentCache(self.file, self.ShotId, function)
+        ret = _PermanentCache(self.file, self.ShotId, function, **self.kwargs)
         return ret
 
     def saveall(self):
@@ -73,13 +89,216 @@ class permanentcachedecorator():
         return os.linesep.join(caches)
 
 
+def _fingerprint(obj, h, seen, packages):
+    '''
+    feeds everything determining the behavior of `obj` into the hash `h`. Functions are
+    followed into the functions they call only within the top level `packages`.
+    '''
+    if isinstance(obj, types.CodeType):
+        h.update(obj.co_code)
+        h.update(repr(obj.co_names).encode())
+        for const in obj.co_consts:
+            _fingerprint(const, h, seen, packages)
+        return
+    from . import core
+    if isinstance(obj, (_PermanentCache, core.Diagnostic, functools.partial,
+                        types.FunctionType, tuple, list, dict, set, frozenset)):
+        # against cycles. The objects are kept, such that their ids are not reused.
+        if id(obj) in seen:
+            h.update(b'<seen>')
+            return
+        seen[id(obj)] = obj
+    if isinstance(obj, (_PermanentCache, core.Diagnostic)):
+        _fingerprint(obj.function, h, seen, packages)
+    elif isinstance(obj, functools.partial):
+        for item in (obj.func, obj.args, obj.keywords):
+            _fingerprint(item, h, seen, packages)
+    elif isinstance(obj, types.MethodType):
+        _fingerprint(obj.__func__, h, seen, packages)
+    elif isinstance(obj, types.FunctionType) \
+            and (obj.__module__ or '').split('.')[0] in packages:
+        code = obj.__code__
+        _fingerprint(code, h, seen, packages)
+        for item in (obj.__defaults__, obj.__kwdefaults__):
+            _fingerprint(item, h, seen, packages)
+        for cell in obj.__closure__ or ():
+            try:
+                _fingerprint(cell.cell_contents, h, seen, packages)
+            except(ValueError):
+                # empty cell
+                pass
+        # the functions and constants used
+        for name in _allnames(code):
+            if name in obj.__globals__:
+                _fingerprint(obj.__globals__[name], h, seen, packages)
+            elif name in core.Shot.diagnostics:
+                # the diagnostic called by `shot.name()`
+                _fingerprint(core.Shot.diagnostics[name], h, seen, packages)
+    elif isinstance(obj, (type, types.ModuleType, types.FunctionType,
+                          types.BuiltinFunctionType)):
+        # only the name of classes, modules and functions of other packages
+        name = '{}.{}'.format(getattr(obj, '__module__', ''), obj.__name__)
+        h.update(name.encode())
+    elif isinstance(obj, (tuple, list, dict, set, frozenset)):
+        h.update(type(obj).__name__.encode())
+        ordered = isinstance(obj, (tuple, list))
+        if isinstance(obj, dict):
+            obj = [(k, v) for k, v in obj.items()]
+            seen[id(obj)] = obj
+        # the order of sets and dicts does not matter
+        digests = []
+        for item in obj:
+            sub = hashlib.sha1()
+            _fingerprint(item, sub, seen, packages)
+            digests.append(sub.digest())
+        if not ordered:
+            digests.sort()
+        h.update(b''.join(digests))
+    elif isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+        h.update('{}{}'.format(obj.dtype.str, obj.shape).encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, np.ndarray):
+        _fingerprint(obj.tolist(), h, seen, packages)
+    elif isinstance(obj, (bool, int, float, complex, str, bytes, type(None),
+                          np.number, np.bool_)):
+        h.update(pickle.dumps(obj, protocol=4))
+    else:
+        # any other object only by its type. Its pickle may depend on the session,
+        # e.g. on the order of a set of strings.
+        name = '{}.{}'.format(type(obj).__module__, type(obj).__qualname__)
+        h.update(name.encode())
+
+
+def _allnames(code):
+    ret = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            ret.extend(_allnames(const))
+    return ret
+
+
+def _codeversion(function):
+    '''
+    returns a hash of the bytecode, the closure and the defaults of `function` and of all
+    functions and diagnostics it refers to, which are defined in the same package, in
+    `__main__` or in `postexperiment`.
+    '''
+    h = hashlib.sha1()
+    module = getattr(function, '__module__', None) or '__main__'
+    packages = {module.split('.')[0], '__main__', __name__.split('.')[0]}
+    _fingerprint(function, h, dict(), packages)
+    return h.hexdigest()
+
+
+class _BlobPickler(pickle.Pickler):
+    '''
+    pickles with protocol 5 and replaces non-contiguous arrays of at least `blobsize` bytes
+    by contiguous copies. Only contiguous buffers can be left out of the pickle.
+    '''
+
+    def __init__(self, file, blobsize, buffer_callback):
+        super().__init__(file, protocol=5, buffer_callback=buffer_callback)
+        self.blobsize = blobsize
+
+    def reducer_override(self, obj):
+        if type(obj) is np.ndarray and not obj.dtype.hasobject \
+                and obj.nbytes >= self.blobsize \
+                and not (obj.flags.c_contiguous or obj.flags.f_contiguous):
+            return np.ascontiguousarray(obj).__reduce_ex__(5)
+        return NotImplemented
+
+
 class _PermanentCache():
     '''
     A permanent cache for a function.
 
+    The results are stored in a sqlite database `{file}_{functionname}.cache.sqlite`,
+    which is indexed by the key of the call. Entries are read from disk only when they
+    are looked up, such that the startup time does not depend on the size of the cache.
+    Multiple processes -- even on different hosts sharing the file system, as long as
+    sqlite locking works there -- can read and write the same database concurrently.
+    New results are collected in memory and written in a single transaction by `save`.
+
+    Large arrays within the results -- numpy arrays or the data of postpic Fields -- are
+    not stored in the database, but in a content addressed blob store in the directory
+    `{file}_{functionname}.cache.blobs`. The blobs are memory mapped when read, hence
+    the arrays of results read from disk are read-only. The least recently used blobs
+    are evicted together with the entries referring to them, as soon as the blobs
+    exceed the disk budget `maxbytes`.
+
+    The entries are valid for a single version of the function, which is a hash of its
+    bytecode, closure and defaults including all functions and diagnostics called by it.
+    Entries of other versions are removed after `load`. The version is determined on
+    the first use after `load`, when all diagnostics called by the function have been
+    registered, such that it does not depend on the order of the registrations.
+    Explicitly created `common.Context` objects bypass the cache.
+
+    New entries are written behind by a background thread shared by all caches. It
+    wakes up every `_PermanentCache.flushinterval` seconds, or as soon as a cache holds
+    `_PermanentCache.batchsize` new entries, and writes at most `batchsize` entries per
+    transaction, such that a crash loses at most the entries of the last
+    `flushinterval` seconds. Setting `flushinterval` to `None` disables the thread,
+    then entries are only written by `save`.
+
+    The cache can be pickled and is attached to the same database in the worker
+    processes of a `ShotExecutor`. Workers write their new entries after every chunk,
+    such that they are visible to all other workers and to the calling process, where
+    they are read on demand. The hits and the execution times of the workers are added
+    to the statistics of the cache in the calling process.
+
+    kwargs
+    ------
+      maxsize=250:
+        results without large arrays are only cached, if `sys.getsizeof` of the result
+        does not exceed `maxsize` bytes. `None` caches all results.
+
+      blobsize=65536:
+        arrays of at least `blobsize` bytes are moved to the blob store.
+
+      maxbytes=10e9:
+        the disk budget of the blob store in bytes.
+
     Stephan Kuschel, 2018
     '''
     _filelock = dict()
+    flushinterval = 5.0
+    batchsize = 64
+    _wakeup = threading.Event()
+    _writer = None
+    _writerpid = None
+
+    @classmethod
+    def _startwriter(cls):
+        '''
+        starts the write-behind thread, if it is not running in this process.
+        '''
+        if cls.flushinterval is None:
+            return
+        if cls._writer is not None and cls._writerpid == os.getpid() \
+                and cls._writer.is_alive():
+            return
+        cls._writer = threading.Thread(target=cls._writeloop, daemon=True,
+                                       name='postexperiment cache writer')
+        cls._writerpid = os.getpid()
+        cls._writer.start()
+
+    @classmethod
+    def _writeloop(cls):
+        while cls.flushinterval is not None:
+            cls._wakeup.wait(cls.flushinterval)
+            cls._wakeup.clear()
+            cls._flushall()
+
+    @classmethod
+    def _flushall(cls):
+        for c in list(cls._filelock.values()):
+            try:
+                while c.flush() == cls.batchsize:
+                    # there is more
+                    pass
+            except(Exception) as e:
+                # keep the entries in memory. They are retried next time.
+                print('writing {} failed: {}'.format(c, e))
 
     @classmethod
     def saveall(cls):
@@ -104,12 +323,11 @@ class _PermanentCache():
     @staticmethod
     def _absfile(name, functionname):
         '''
-        creates absolute file name from a given cache-filename
+        creates the absolute file name of the database and the glob matching the
+        pickle files used by earlier versions.
         '''
+        file = '{name}_{functionname}.cache.sqlite'.format(name=name, functionname=functionname)
         template = '{name}_{functionname}.cache-{host}-{pid}'
-        hostname = socket.gethostname()
-        pid = os.getpid()
-        file = template.format(name=name, functionname=functionname, host=hostname, pid=pid)
         fileglob = template.format(name=name, functionname=functionname, host='*', pid='*')
         return os.path.abspath(file), os.path.abspath(fileglob)
 
@@ -126,48 +344,225 @@ class _PermanentCache():
         cls._filelock[absfile] = ret
         return ret
 
-    def __init__(self, file, ShotId, function, maxsize=250, load=True):
+    def __init__(self, file, ShotId, function, maxsize=250, load=True,
+                 blobsize=65536, maxbytes=10e9):
         functools.update_wrapper(self, function)
+        self._prefix = os.path.abspath(file)
         self.file, self.globfile = self._absfile(file, function.__name__)
+        self.blobdir = os.path.splitext(self.file)[0] + '.blobs'
         self._maxsize = maxsize
+        self.blobsize = blobsize
+        self.maxbytes = maxbytes
+        # the access times of blobs read since the last `save`
+        self._touched = dict()
         self.ShotId = ShotId
         self.function = function
+        self._version = None
+        # remove the entries of other versions, once the version is known
+        self._purge = False
+        self._lock = threading.RLock()
+        # serializes writers, such that entries are written in order
+        self._writelock = threading.Lock()
+        self._db = None
+        self._pid = None
         self.clearcache()
         # load data
         if load:
             self.load()
+        self._startwriter()
+
+    @classmethod
+    def _attach(cls, prefix, ShotId, function, version, kwargs):
+        '''
+        returns the cache of this process for the database of `prefix` and `function`.
+        Used on unpickling.
+
+        The version is taken from the pickling process, as the registry of diagnostics
+        may differ here. The database is not loaded, such that the entries of the
+        pickling process are never removed.
+        '''
+        absfile, _ = cls._absfile(prefix, function.__name__)
+        if absfile in cls._filelock:
+            ret = cls._filelock[absfile]
+        else:
+            ret = cls(prefix, ShotId, function, load=False, **kwargs)
+        ret.version = version
+        return ret
+
+    def __reduce__(self):
+        # by reference, if this cache is reachable by its name, which is the case
+        # for functions decorated at module level.
+        obj = sys.modules.get(self.__module__)
+        for name in self.__qualname__.split('.'):
+            obj = getattr(obj, name, None)
+        if obj is self:
+            return self.__qualname__
+        kwargs = dict(maxsize=self._maxsize, blobsize=self.blobsize, maxbytes=self.maxbytes)
+        return (self._attach, (self._prefix, self.ShotId, self.function, self.version, kwargs))
 
     def __del__(self):
         self.save()
 
+    @property
+    def version(self):
+        '''
+        the hash of the function and everything it depends on. See `_codeversion`.
+        '''
+        if self._version is None:
+            self._version = _codeversion(self.function)
+        if self._purge:
+            self._purge = False
+            with self._lock:
+                with self.db as db:
+                    n = db.execute('DELETE FROM cache WHERE version IS NOT ?',
+                                   (self._version,)).rowcount
+            if n > 0:
+                print('"{}": {} entries of other versions removed.'.format(self.file, n))
+        return self._version
+
+    @version.setter
+    def version(self, version):
+        self._version = version
+        self._purge = False
+
+    @property
+    def db(self):
+        '''
+        the connection to the database. Every process uses its own connection.
+        '''
+        if self._db is None or self._pid != os.getpid():
+            import sqlite3
+            db = sqlite3.connect(self.file, timeout=60, check_same_thread=False)
+            try:
+                # allows readers while another process is writing
+                db.execute('PRAGMA journal_mode=WAL')
+            except(sqlite3.OperationalError):
+                # e.g. on network file systems
+                pass
+            with db:
+                # blobs contains the space separated digests of the buffers of value
+                db.execute('CREATE TABLE IF NOT EXISTS cache '
+                           '(key BLOB PRIMARY KEY, value BLOB, blobs TEXT, version TEXT)')
+                db.execute('CREATE TABLE IF NOT EXISTS blobs '
+                           '(digest TEXT PRIMARY KEY, nbytes INTEGER, atime REAL)')
+                db.execute('CREATE TABLE IF NOT EXISTS meta '
+                           '(name TEXT PRIMARY KEY, value REAL)')
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    @staticmethod
+    def _dumpkey(key):
+        # a fixed protocol, such that equal keys are stored equally in all sessions.
+        return pickle.dumps(key, protocol=4)
+
+    def _blobfile(self, digest):
+        return os.path.join(self.blobdir, digest)
+
+    def _dumpvalue(self, val):
+        '''
+        pickles `val`. Returns the pickle and the list of large buffers, which have been
+        left out of the pickle.
+        '''
+        buffers = []
+
+        def callback(buf):
+            if buf.raw().nbytes < self.blobsize:
+                return True  # in-band
+            buffers.append(buf)
+        f = io.BytesIO()
+        _BlobPickler(f, self.blobsize, callback).dump(val)
+        return f.getvalue(), buffers
+
+    def _writeblob(self, buf):
+        '''
+        writes the buffer `buf` to the blob store and returns its digest and size.
+        '''
+        data = buf.raw()
+        digest = hashlib.sha1(data).hexdigest()
+        file = self._blobfile(digest)
+        if not os.path.exists(file):
+            os.makedirs(self.blobdir, exist_ok=True)
+            tmp = '{}.{}-{}'.format(file, socket.gethostname(), os.getpid())
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            # atomic, such that other processes never read partial blobs
+            os.replace(tmp, file)
+        return digest, data.nbytes
+
+    def _readblob(self, digest):
+        file = self._blobfile(digest)
+        if os.path.getsize(file) == 0:
+            # empty files cannot be mapped
+            return b''
+        return np.memmap(file, dtype=np.uint8, mode='r')
+
+    def _lookup(self, key):
+        with self._lock:
+            row = self.db.execute('SELECT value, blobs FROM cache WHERE key=? AND version=?',
+                                  (self._dumpkey(key), self.version)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        value, blobs = row
+        digests = blobs.split() if blobs else []
+        try:
+            buffers = [self._readblob(digest) for digest in digests]
+        except(FileNotFoundError):
+            # evicted by another process
+            raise KeyError(key)
+        ret = pickle.loads(value, buffers=buffers)
+        now = time.time()
+        with self._lock:
+            for digest in digests:
+                self._touched[digest] = now
+        self.cache[key] = ret
+        return ret
+
     def __getitem__(self, key):
         '''
         the cache access.
         '''
-        if key in self.cache:
+        if key in self.cachenew:
+            ret = self.cachenew[key]
+        elif key in self.cache:
             ret = self.cache[key]
         else:
-            ret = self.cachenew[key]
+            ret = self._lookup(key)
         self.hits += 1
         return ret
 
     def __setitem__(self, key, val):
-        self.cachenew[key] = val
+        with self._lock:
+            self.cachenew[key] = val
+            n = len(self.cachenew)
+        if n >= self.batchsize:
+            self._wakeup.set()
+
+    @staticmethod
+    def _kwargskey(kwargs):
+        '''
+        the part of the key representing the keys and values of `kwargs`.
+        '''
+        ret = tuple(sorted((k, v) for k, v in kwargs.items() if k != 'context'))
+        try:
+            hash(ret)
+        except(TypeError):
+            # e.g. arrays
+            ret = hashlib.sha1(pickle.dumps(ret, protocol=4)).hexdigest()
+        return ret
 
     def __call__(self, shot, **kwargs):
-        shotid = self.ShotId(shot)
-        idx = (shotid, tuple(sorted(kwargs.items())))  # this contains keys and values of kwargs
-        idxold = (shotid, tuple(sorted(kwargs)))  # this one contains only the keys of kwargs
+        context = kwargs.get('context')
+        if context is not None and not isinstance(context, common.DefaultContext):
+            return self.function(shot, **kwargs)
+        idx = (self.ShotId(shot), self._kwargskey(kwargs))
         try:
-            try:
-                ret = self[idx]
-            except(KeyError):
-                ret = self[idxold]
+            ret = self[idx]
         except(KeyError):
             t0 = time.time()
             ret = self.function(shot, **kwargs)
             self.exectime = time.time() - t0
-            if self._maxsize is None or sys.getsizeof(ret) <= self._maxsize:
+            if self._maxsize is None or sys.getsizeof(ret) <= self._maxsize \
+                    or common.nbytes(ret) >= self.blobsize:
                 self[idx] = ret
         return ret
 
@@ -185,7 +580,10 @@ class _PermanentCache():
         self.n_exec += 1
 
     def clearcache(self):
-        # cache will be populated by data read from disc
+        '''
+        clears the data held in memory. The database is not changed.
+        '''
+        # cache holds the entries read from the database
         self.cache = dict()
         # cachenew will be populated by new function executions
         # during runtime
@@ -193,65 +591,172 @@ class _PermanentCache():
         self.hits = 0
         self._exectime = 0
         self.n_exec = 0
+        # the statistics already reported by `_WorkerHook`
+        self._reported = (0, 0, 0.0)
+
+    def _report(self):
+        '''
+        returns the hits, executions and total execution time since the last report.
+        '''
+        total = (self.hits, self.n_exec, self.exectime * self.n_exec)
+        ret = tuple(a - b for a, b in zip(total, self._reported))
+        self._reported = total
+        return ret
+
+    def _merge(self, hits, n_exec, exectime):
+        '''
+        adds the statistics reported by a worker.
+        '''
+        self.hits += hits
+        if n_exec > 0:
+            total = self.exectime * self.n_exec + exectime
+            self.n_exec += n_exec
+            self._exectime = total / self.n_exec
 
     def save(self):
         '''
-        the function returns the filename, which has actually been used for saving.
+        writes all new entries to the database. Returns the filename of the database
+        or `None` if there was nothing to save.
         '''
-        if len(self.cachenew) == 0:
+        n = self.flush(None)
+        if n == 0:
             # there is no new data, which would require saving.
             return None
-        for i in range(100):
-            nextfile = '{}-{}'.format(self.file, i)
-            if not os.path.isfile(nextfile):
-                break
-        else:
-            print('autorun Garbage Collection...')
-            # gc starts this routine again after deleting files.
-            return self.gc()
-        with open(nextfile, 'wb') as f:
-            pickle.dump((self.exectime, self.cachenew), f)
-        print('"{}" ({} entries) saved.'.format(nextfile, len(self.cachenew)))
-        self.cache.update(self.cachenew)
-        self.cachenew = {}
-        return nextfile
+        print('"{}" ({} entries) saved.'.format(self.file, n))
+        return self.file
 
-    @staticmethod
-    def _loaddata(file):
-        s = 'loading {:.1f} MB from {}'
-        size = os.path.getsize(file) / 1e6
-        print(s.format(size, file))
-        with open(file, 'rb') as f:
-            exectime, cache = pickle.load(f)
-        return exectime, cache
-
-    def _loadalldata(self):
-        files = glob.glob(self.globfile)
-        cache = {}
-        exectime = 0
+    def flush(self, n=-1):
+        '''
+        writes up to `n` new entries in a single transaction and returns the number of
+        entries written. `n=-1` uses `self.batchsize` and `n=None` writes all new
+        entries. The entries stay readable from memory while they are being written.
+        The access times of the blobs read are written as well.
+        '''
+        n = self.batchsize if n == -1 else n
+        with self._writelock:
+            with self._lock:
+                entries = list(itertools.islice(self.cachenew.items(), n))
+                touched = len(self._touched) > 0
+            if not entries and not touched:
+                return 0
+            # also writes the access times of a session reading only
+            self._insert(entries)
+            with self._lock:
+                for key, val in entries:
+                    if self.cachenew.get(key) is val:
+                        del self.cachenew[key]
+                    self.cache[key] = val
+        return len(entries)
+
+    def _insert(self, entries):
+        '''
+        writes the `(key, value)` pairs `entries` to the database and the blob store
+        and evicts blobs exceeding the disk budget.
+        '''
+        rows = []
+        blobs = dict()
+        for key, val in entries:
+            value, buffers = self._dumpvalue(val)
+            digests = []
+            for buf in buffers:
+                digest, nbytes = self._writeblob(buf)
+                blobs[digest] = nbytes
+                digests.append(digest)
+            rows.append((self._dumpkey(key), value, ' '.join(digests), self.version))
+        now = time.time()
+        with self._lock, self.db as db:
+            touched = [(t, d) for d, t in self._touched.items()]
+            self._touched = dict()
+            db.executemany('INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)',
+                           [(d, n, now) for d, n in blobs.items()])
+            db.executemany('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)', rows)
+            db.executemany('UPDATE blobs SET atime=max(atime, ?) WHERE digest=?', touched)
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                       ('exectime', self.exectime))
+        self.evict()
+
+    def evict(self, maxbytes=None):
+        '''
+        removes the least recently used blobs and the entries referring to them,
+        until the blobs use at most `maxbytes` (defaults to `self.maxbytes`).
+        Returns the number of removed entries.
+        '''
+        maxbytes = self.maxbytes if maxbytes is None else maxbytes
+        removed = 0
+        with self._lock, self.db as db:
+            total, = db.execute('SELECT COALESCE(SUM(nbytes), 0) FROM blobs').fetchone()
+            if total <= maxbytes:
+                return removed
+            rows = db.execute('SELECT digest, nbytes FROM blobs ORDER BY atime').fetchall()
+            for digest, nbytes in rows:
+                if total <= maxbytes:
+                    break
+                query = 'SELECT key FROM cache WHERE instr(blobs, ?)'
+                keys = [k for k, in db.execute(query, (digest,))]
+                db.executemany('DELETE FROM cache WHERE key=?', [(k,) for k in keys])
+                db.execute('DELETE FROM blobs WHERE digest=?', (digest,))
+                removed += len(keys)
+                total -= nbytes
+                try:
+                    os.remove(self._blobfile(digest))
+                except(FileNotFoundError):
+                    pass
+        return removed
+
+    def _removelegacy(self):
+        '''
+        removes the pickle files of earlier versions. Their entries are not versioned
+        and some of them may belong to different kwargs, hence they cannot be used.
+        '''
+        files = sorted(set(glob.glob(self.globfile) + glob.glob(self.globfile + '-*')))
         for file in files:
-            exectime, c = self._loaddata(file)
-            cache.update(c)
-        return exectime, cache, files
+            print('removing outdated cache file {}'.format(file))
+            os.remove(file)
+        return files
 
     def load(self):
-        self.exectime, self.cache, _ = self._loadalldata()
+        '''
+        connects to the database. The entries are read on demand. The entries of other
+        versions of the function are removed on first use.
+        '''
+        self.cache = dict()
+        self._version = None
+        self._purge = True
+        with self._lock:
+            row = self.db.execute("SELECT value FROM meta WHERE name='exectime'").fetchone()
+        if row is not None and self.n_exec == 0:
+            self._exectime = row[0]
         self.hits = 0
 
     def gc(self, delete=True):
         '''
-        Merge existing data files and save current data.
+        saves the current data, removes the files of earlier versions of this module
+        and blobs, which are not referred to anymore, and compacts the database.
         '''
-        _, cache, files = self._loadalldata()
-        nextfile = self.file + '-gc'
-        with open(nextfile, 'wb') as f:
-            pickle.dump((self.exectime, self.cache), f)
-        for file in files:
-            os.remove(file)
-        return self.save()
+        ret = self.save()
+        self._removelegacy()
+        with self._lock:
+            with self.db as db:
+                digests = [d for d, in db.execute('SELECT digest FROM blobs')]
+                referenced = set()
+                for blobs, in db.execute("SELECT blobs FROM cache WHERE blobs != ''"):
+                    referenced.update(blobs.split())
+                unused = [(d,) for d in digests if d not in referenced]
+                db.executemany('DELETE FROM blobs WHERE digest=?', unused)
+            for digest, in unused:
+                try:
+                    os.remove(self._blobfile(digest))
+                except(FileNotFoundError):
+                    pass
+            self.db.execute('VACUUM')
+        return ret
 
     def __len__(self):
-        return len(self.cache) + len(self.cachenew)
+        version = self.version
+        with self._lock:
+            n, = self.db.execute('SELECT COUNT(*) FROM cache WHERE version=?',
+                                 (version,)).fetchone()
+        return n + len(self.cachenew)
 
     def __str__(self):
         if len(self.cachenew) == 0:
@@ -264,3 +769,150 @@ class _PermanentCache():
         return ret
 
     __repr__ = __str__
+
+
+atexit.register(_PermanentCache._flushall)
+
+
+def _afterfork():
+    # the locks may have been held by another thread of the parent and the
+    # statistics of the parent must not be reported again by the child.
+    for c in _PermanentCache._filelock.values():
+        c._lock = threading.RLock()
+        c._writelock = threading.Lock()
+        c._reported = (c.hits, c.n_exec, c.exectime * c.n_exec)
+
+
+os.register_at_fork(after_in_child=_afterfork)
+
+
+@parallel.register_workerhook
+class _WorkerHook():
+    '''
+    writes the new entries of all caches of a worker process after every chunk
+    and reports their statistics to the calling process.
+    '''
+
+    @staticmethod
+    def collect():
+        ret = dict()
+        for file, c in list(_PermanentCache._filelock.items()):
+            c.flush(None)
+            report = c._report()
+            if any(report):
+                ret[file] = report
+        return ret
+
+    @staticmethod
+    def merge(report):
+        for file, stats in report.items():
+            c = _PermanentCache._filelock.get(file)
+            if c is not None:
+                c._merge(*stats)
+
+
+MemoInfo = collections.namedtuple('MemoInfo',
+                                  ['hits', 'misses', 'evictions', 'entries', 'nbytes',
+                                   'maxbytes'])
+
+
+class MemoCache():
+    '''
+    An in-memory cache for the results of diagnostics. Results are identified by the
+    diagnostic, the ShotId of the shot and the arguments. If the results exceed
+    `maxbytes`, the least recently used results are evicted.
+
+    Install it for all diagnostics by setting `Diagnostic.memo`:
+      `Diagnostic.memo = MemoCache(shotseries.ShotId)`
+
+    Cached results are returned as they are, so they must not be changed.
+
+    kwargs
+    ------
+      maxbytes=256e6:
+        the maximum size of all cached results in bytes. Larger results are not cached.
+    '''
+
+    def __init__(self, ShotId, maxbytes=256e6):
+        self.ShotId = ShotId
+        self.maxbytes = maxbytes
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._cache = collections.OrderedDict()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def key(self, function, shot, args, kwargs):
+        '''
+        returns the key for the call `function(shot, *args, **kwargs)` or `None`
+        if the call cannot be cached.
+        '''
+        context = kwargs.get('context')
+        if context is not None and not isinstance(context, common.DefaultContext):
+            # explicitly created Contexts bypass caching. See `common.Context`.
+            return None
+        try:
+            key = (function, self.ShotId(shot), args,
+                   tuple(sorted((k, v) for k, v in kwargs.items() if k != 'context')))
+            hash(key)
+        except(KeyError, TypeError, ValueError):
+            # the shot has no id or the arguments are not hashable.
+            return None
+        return key
+
+    def get(self, key):
+        '''
+        returns the cached result. Raises a `KeyError` if there is none.
+        '''
+        with self._lock:
+            try:
+                ret, _ = self._cache[key]
+            except(KeyError):
+                self.misses += 1
+                raise
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return ret
+
+    def put(self, key, value):
+        size = common.nbytes(value)
+        if size > self.maxbytes:
+            return
+        with self._lock:
+            if key in self._cache:
+                self.nbytes -= self._cache.pop(key)[1]
+            self._cache[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                _, (_, s) = self._cache.popitem(last=False)
+                self.nbytes -= s
+                self.evictions += 1
+
+    def info(self):
+        '''
+        returns the statistics as a `MemoInfo` namedtuple.
+        '''
+        return MemoInfo(self.hits, self.misses, self.evictions, len(self._cache),
+                        self.nbytes, self.maxbytes)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __getstate__(self):
+        # the cached results stay in this process
+        return dict(ShotId=self.ShotId, maxbytes=self.maxbytes)
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __str__(self):
+        s = '<MemoCache ({} entries, {:.1f} of {:.1f} MB, {} hits, {} misses)>'
+        return s.format(len(self), self.nbytes / 1e6, self.maxbytes / 1e6,
+                        self.hits, self.misses)
+
+    __repr__ = __str__
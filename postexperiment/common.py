@@ -19,12 +19,29 @@ Alexander Blinne, 2018
 '''
 
 
+import sys
 import collections
 import functools
 
 import numpy as np
 
 
+def nbytes(obj):
+    '''
+    estimates the memory used by `obj`.
+    '''
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    matrix = getattr(obj, 'matrix', None)  # postpic Fields
+    if isinstance(matrix, np.ndarray):
+        return matrix.nbytes
+    if isinstance(obj, dict):
+        return sum(nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
 def FilterFactory(f):
     '''
     Sets a variable number of default positional arguments,
@@ -28,10 +28,13 @@ Stephan Kuschel, 2018
 import os
 import os.path as osp
 import re
+import time
+import pickle
+import concurrent.futures as cf
 import numpy as np
 
 from .labbook import LabBookSource
-from .lazyaccess import LazyAccessH5, LazyImageReader
+from .lazyaccess import LazyAccessH5, LazyImageReader, h5pool
 
 
 __all__ = ['LabBookSource', 'FileSource', 'H5ArraySource']
@@ -50,53 +53,170 @@ class FileSource():
     name of the field and an optional transformation function for the field (e. g. `int`).
     If the transformation fails, the matched string is stored untransformed.
 
+    The directories are scanned in parallel on `max_workers` threads. The result of the scan
+    is kept in a manifest, such that on reload only directories, which have been modified
+    since, are listed again. If `manifest` is a filename, the manifest is also stored in
+    that file and reused in later sessions.
+
     Alexander Blinne, 2018
     """
 
-    def __init__(self, dirname, pattern, filekey, fields, skiptemp=True, FileReaders=dict()):
+    def __init__(self, dirname, pattern, filekey, fields, skiptemp=True, FileReaders=dict(),
+                 manifest=None, max_workers=None):
         self.dirname = dirname
         self.pattern = re.compile(pattern)
         self.filekey = filekey
         self.fields = fields
         self.skiptemp = skiptemp
         self.FileReaders = FileReaders
+        self.manifest = manifest
+        self.max_workers = max_workers
+        self._manifest = None
+
+    def _manifestid(self):
+        return (self.dirname, self.pattern.pattern, self.pattern.flags, self.skiptemp)
+
+    def _loadmanifest(self):
+        if self._manifest is not None:
+            return self._manifest
+        self._manifest = dict()
+        if self.manifest is not None and osp.isfile(self.manifest):
+            try:
+                with open(self.manifest, 'rb') as f:
+                    manifestid, dirs = pickle.load(f)
+                if manifestid == self._manifestid():
+                    self._manifest = dirs
+            except(Exception):
+                # a broken manifest just means a full scan
+                pass
+        return self._manifest
+
+    def _savemanifest(self):
+        if self.manifest is None:
+            return
+        tmp = '{}.{}.tmp'.format(self.manifest, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump((self._manifestid(), self._manifest), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.manifest)
+
+    def _scandir(self, path, mtime):
+        '''
+        lists the directory `path` and returns the tuple `(mtime, files, subdirs)`.
+        `files` contains the tuples `(name, groups, namedgroups)` of all matching files.
+        '''
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except(OSError):
+            # os.walk ignores unreadable directories, too.
+            return None
+        files, subdirs = [], []
+        for entry in entries:
+            try:
+                isdir = entry.is_dir()
+            except(OSError):
+                isdir = False
+            if isdir:
+                # just like os.walk, do not follow symlinks to directories
+                if not entry.is_symlink():
+                    subdirs.append(entry.name)
+                continue
+            name = entry.name
+            if self.skiptemp and name.endswith('temp'):
+                continue
+            match = self.pattern.match(name)
+            if match:
+                groups = (match.group(0),) + match.groups()
+                files.append((name, groups, match.groupdict()))
+        if time.time() - mtime * 1e-9 < 2:
+            # the directory could still change within the resolution of mtime.
+            mtime = None
+        return mtime, files, subdirs
+
+    def _updatedir(self, path, old):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except(OSError):
+            return None
+        if old is not None and old[0] is not None and old[0] == mtime:
+            return old
+        return self._scandir(path, mtime)
+
+    def scan(self):
+        '''
+        updates the manifest. Only directories modified since the last scan are listed.
+        '''
+        old = self._loadmanifest()
+        new = dict()
+        pending = [self.dirname]
+        with cf.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending:
+                entries = pool.map(self._updatedir, pending, [old.get(p) for p in pending])
+                nextpending = []
+                for path, entry in zip(pending, entries):
+                    if entry is None:
+                        continue
+                    new[path] = entry
+                    nextpending.extend(osp.join(path, d) for d in entry[2])
+                pending = nextpending
+        self._manifest = new
+        self._savemanifest()
+        return new
+
+    def _walk(self, dirs):
+        # the same order as os.walk
+        stack = [self.dirname]
+        while stack:
+            root = stack.pop()
+            if root not in dirs:
+                continue
+            _, files, subdirs = dirs[root]
+            for name, groups, namedgroups in files:
+                yield root, name, groups, namedgroups
+            stack.extend(osp.join(root, d) for d in reversed(subdirs))
+
+    def _genshot(self, path, groups, namedgroups):
+        def group(i):
+            return namedgroups[i] if isinstance(i, str) else groups[i]
+
+        shot = dict()
+
+        if isinstance(self.filekey, int):
+            filekey = groups[self.filekey]
+        else:
+            filekey = self.filekey
 
-    def __call__(self):
-        shots = []
-
-        for root, dirs, files in os.walk(self.dirname):
-            for name in files:
-                if self.skiptemp and name.endswith('temp'):
-                    continue
-
-                path = osp.join(root, name)
-
-                match = self.pattern.match(name)
-                if not match:
-                    continue
-
-                shot = dict()
-                shots.append(shot)
+        # Lookup the filekey in the FileReaders dict for a specialized
+        # LazyFileReader. If there is none, fallback to the LazyImageReader
+        shot[filekey] = self.FileReaders.get(filekey, LazyImageReader)(path)
 
-                if isinstance(self.filekey, int):
-                    filekey = match.group(self.filekey)
+        for i, (n, t) in self.fields.items():
+            try:
+                if t:
+                    shot[n] = t(group(i))
                 else:
-                    filekey = self.filekey
-
-                # Lookup the filekey in the FileReaders dict for a specialized
-                # LazyFileReader. If there is none, fallback to the LazyImageReader
-                shot[filekey] = self.FileReaders.get(filekey, LazyImageReader)(path)
+                    shot[n] = group(i)
+            except ValueError:
+                shot[n] = group(i)
+        return shot
 
-                for i, (n, t) in self.fields.items():
-                    try:
-                        if t:
-                            shot[n] = t(match.group(i))
-                        else:
-                            shot[n] = match.group(i)
-                    except ValueError:
-                        shot[n] = match.group(i)
+    def __call__(self):
+        return [self._genshot(osp.join(root, name), groups, namedgroups)
+                for root, name, groups, namedgroups in self._walk(self.scan())]
 
-        return shots
+    def poll(self, cursor=None):
+        '''
+        returns the tuple `(shots, cursor)`, where `shots` is the list of shots found
+        since `cursor` was returned. Use `cursor=None` to get all shots.
+        '''
+        cursor = set() if cursor is None else set(cursor)
+        shots = []
+        for root, name, groups, namedgroups in self._walk(self.scan()):
+            path = osp.join(root, name)
+            if path not in cursor:
+                cursor.add(path)
+                shots.append(self._genshot(path, groups, namedgroups))
+        return shots, cursor
 
 
 class H5ArraySource():
@@ -120,6 +240,7 @@ class H5ArraySource():
         self._filename = filename
         self._validkey = validkey
         self._validkeys = None
+        self._len = None
 
     @property
     def filename(self):
@@ -136,11 +257,9 @@ class H5ArraySource():
         return self._validkeys
 
     def __len__(self):
-        import h5py
-        h5 = h5py.File(self.filename, 'r')
-        ret = h5[self.validkey].shape[0]
-        h5.close()
-        return ret
+        if self._len is None:
+            self._len = h5pool.dataset(self.filename, self.validkey).shape[0]
+        return self._len
 
     def _genkeylist(self, validkey):
         '''
@@ -177,9 +296,7 @@ class H5ArraySource():
                 retsmall.append(key)
             else:
                 retlarge.append(key)
-        h5 = h5py.File(self.filename, 'r')
-        h5.visititems(visitf)
-        h5.close()
+        h5pool.file(self.filename).visititems(visitf)
         return retsmall, retlarge
 
     def __call__(self):
@@ -188,26 +305,59 @@ class H5ArraySource():
         '''
         return self.gendatadict()
 
-    def gendatadict(self, n=None):
+    def gencolumns(self, chunksize=2**16, start=0):
+        '''
+        yields the small data of `chunksize` consecutive events at a time as a dictionary
+        mapping each small key to a numpy array. Every dataset is read with a single
+        slice per chunk, such that files larger than the memory can be processed.
+        The first event is `start`.
+        '''
+        smallkeys, _ = self.validkeys
+        dsets = {key: h5pool.dataset(self.filename, key) for key in smallkeys}
+        n = len(self)
+        chunksize = max(n if chunksize is None else int(chunksize), 1)
+        for start in range(start, n, chunksize):
+            stop = min(start + chunksize, n)
+            yield {key: dsets[key][start:stop] for key in smallkeys}
+
+    def gendatadict(self, n=None, chunksize=2**16):
         '''
         creates the datadict for the nth event.
         Creates a list of events if n is not given
         '''
-        import h5py
         smallkeys, largekeys = self.validkeys
-        # this is compuationally surprisingly cheap
-        h5 = h5py.File(self.filename, 'r')
-        # creating the h5datasets only once cuts execution time in half.
-        dsets = {key: h5[key] for key in smallkeys}
-
-        def gendict(i):
-            d = {key: dsets[key][i] for key in smallkeys}
-            # key not given, index is fixed
-            la = LazyAccessH5(self.filename, index=i)
-            d.update({key: la for key in largekeys})
-            return d
-        if n is None:
-            for i in range(len(self)):
-                yield gendict(i)
-        else:
-            return gendict(n)
+        if n is not None:
+            dsets = {key: h5pool.dataset(self.filename, key) for key in smallkeys}
+            return self._gendict(n, {key: dsets[key][n] for key in smallkeys}, largekeys)
+        return self._genrows(chunksize)
+
+    def _gendict(self, i, d, largekeys):
+        # key not given, index is fixed
+        la = LazyAccessH5(self.filename, index=i)
+        d.update({key: la for key in largekeys})
+        return d
+
+    def poll(self, cursor=None):
+        '''
+        returns the tuple `(shots, cursor)`, where `shots` is the list of all events
+        appended to the file since `cursor` was returned. Use `cursor=None` to get
+        all events.
+        '''
+        # reopen the file to see the appended data
+        h5pool.release(self.filename)
+        self._len = None
+        start = 0 if cursor is None else cursor
+        shots = list(self._genrows(None, start=start))
+        return shots, start + len(shots)
+
+    def _genrows(self, chunksize, start=0):
+        _, largekeys = self.validkeys
+        chunksize = len(self) if chunksize is None else max(int(chunksize), 1)
+        i = start
+        for columns in self.gencolumns(chunksize=chunksize, start=start):
+            nrows = len(next(iter(columns.values()))) if columns \
+                else min(chunksize, len(self) - i)
+            for j in range(nrows):
+                d = {key: column[j] for key, column in columns.items()}
+                yield self._gendict(i, d, largekeys)
+                i += 1
@@ -27,24 +27,40 @@ def ImageReader(filename):
 
 
 @common.FilterFactory
-def RawReader(fname, name, width, height, bands=1, bands_axis=2, dtype=np.uint16, **kwargs):
-    d = np.fromfile(fname, dtype=dtype)
+def RawReader(fname, name, width, height, bands=1, bands_axis=2, dtype=np.uint16,
+              memmap=False, asfloat=True, **kwargs):
+    '''
+    reads a raw camera image.
 
+    kwargs
+    ------
+      memmap=False:
+        map the file into memory instead of reading it. The data is only loaded
+        from disk when accessed. The map is copy-on-write, hence changing the data
+        never changes the file.
+
+      asfloat=True:
+        convert the data to float. Without the conversion the data keeps `dtype`
+        and, if `memmap=True`, the field's matrix is a view into the file.
+    '''
     shape = [height, width]
     if bands > 1:
         shape.insert(bands_axis, bands)
 
-    d = d.reshape(shape)
+    if memmap:
+        d = np.memmap(fname, dtype=dtype, mode='c', shape=tuple(shape))
+    else:
+        d = np.fromfile(fname, dtype=dtype).reshape(shape)
 
     if bands > 1:
         # switch to pixel-inverleaved mode, default for matplotlib
-        d = np.moveaxis(d, bands_index, 2)
+        d = np.moveaxis(d, bands_axis, 2)
 
     # switch to PostPic.Field compatible axes
     d = np.swapaxes(d, 0, 1)[:, ::-1, ...]
 
-    # convert to float
-    d = np.asfarray(d)
+    if asfloat:
+        d = np.asfarray(d)
 
     axes = []
     axes.append(pp.Axis(name='x', unit='px',
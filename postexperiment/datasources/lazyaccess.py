@@ -14,13 +14,17 @@
 # You should have received a copy of the GNU General Public License
 # along with postexperiment. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import threading
+import collections
 import numpy as np
 import abc
 from future.utils import with_metaclass
 
 from .filereaders import ImageReader
 
-__all__ = ['LazyAccess', 'LazyAccessDummy', 'LazyAccessH5', 'Make_LazyReader', 'LazyImageReader']
+__all__ = ['LazyAccess', 'LazyAccessDummy', 'LazyAccessH5', 'Make_LazyReader', 'LazyImageReader',
+           'H5FilePool', 'h5pool', 'accessbatch']
 
 
 class LazyAccess(with_metaclass(abc.ABCMeta, object)):
@@ -35,6 +39,41 @@ class LazyAccess(with_metaclass(abc.ABCMeta, object)):
         '''
         pass
 
+    @classmethod
+    def accessbatch(cls, items):
+        '''
+        accesses many LazyAccess objects of this class at once. `items` is a list
+        of tuples `(lazyaccess, shot, key)` and a list of the accessed data is
+        returned in the same order.
+
+        Subclasses may override this method to combine the reads.
+        '''
+        return [la.access(shot, key) for la, shot, key in items]
+
+    def storagekey(self, shot, key):
+        '''
+        returns a sortable tuple describing where the data is stored or `None`
+        if unknown. Objects accessed in the order of their storage keys
+        read the underlying storage sequentially.
+        '''
+        return None
+
+
+def accessbatch(items):
+    '''
+    accesses a list of tuples `(lazyaccess, shot, key)` and returns a list of
+    the data in the same order. The items are grouped by the class of the
+    LazyAccess object, such that every class can combine its reads.
+    '''
+    groups = collections.OrderedDict()
+    for i, item in enumerate(items):
+        groups.setdefault(type(item[0]), []).append(i)
+    ret = [None] * len(items)
+    for cls, idx in groups.items():
+        for i, data in zip(idx, cls.accessbatch([items[i] for i in idx])):
+            ret[i] = data
+    return ret
+
 
 class _LazyAccessException(Exception):
     '''
@@ -57,15 +96,103 @@ class LazyAccessDummy(LazyAccess):
         if self.exceptonaccess:
             raise _LazyAccessException('Access denied.')
         print('Accessing LazyAccessDummy(seed={}) at {}'.format(self.seed, key))
-        # set seed for reproducibility
-        np.random.seed(self.seed)
-        return np.random.rand(1000, 1700)
+        # set seed for reproducibility. Use a local state to be thread safe.
+        return np.random.RandomState(self.seed).rand(1000, 1700)
 
     def __str__(self):
         s = '<LazyAccessDummy(seed={})>'
         return s.format(self.seed)
 
 
+class H5FilePool():
+    '''
+    A pool of hdf5 files opened for reading, which are kept open between accesses.
+    At most `maxfiles` files are kept open; the least recently used file is
+    released first. Released files are closed by h5py as soon as no dataset
+    refers to them anymore.
+
+    The pool is thread safe. After a fork the child process opens its own handles.
+    '''
+
+    def __init__(self, maxfiles=32):
+        self.maxfiles = maxfiles
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._files = collections.OrderedDict()
+        self._datasets = dict()
+        self._pid = os.getpid()
+
+    def _checkpid(self):
+        if self._pid != os.getpid():
+            # handles inherited from the parent process must not be used.
+            self._reset()
+
+    def file(self, filename):
+        '''
+        returns the open `h5py.File` of `filename`.
+        '''
+        import h5py
+        with self._lock:
+            self._checkpid()
+            h5 = self._files.get(filename)
+            if h5 is not None:
+                self._files.move_to_end(filename)
+                return h5
+            h5 = h5py.File(filename, 'r')
+            self._files[filename] = h5
+            while len(self._files) > max(self.maxfiles, 1):
+                old, _ = self._files.popitem(last=False)
+                self._datasets = {k: v for k, v in self._datasets.items() if k[0] != old}
+            return h5
+
+    def dataset(self, filename, key):
+        '''
+        returns the object `key` of the file `filename`. The object is cached.
+        '''
+        with self._lock:
+            h5 = self.file(filename)
+            dset = self._datasets.get((filename, key))
+            if dset is None:
+                dset = h5[key]
+                self._datasets[(filename, key)] = dset
+            return dset
+
+    def release(self, filename):
+        '''
+        releases the file `filename`, such that it is opened again on next use.
+        This is needed to see data appended to the file since it was opened.
+        '''
+        with self._lock:
+            self._checkpid()
+            self._files.pop(filename, None)
+            self._datasets = {k: v for k, v in self._datasets.items() if k[0] != filename}
+
+    def close(self):
+        '''
+        closes all files of the pool.
+        '''
+        with self._lock:
+            if self._pid == os.getpid():
+                for h5 in self._files.values():
+                    h5.close()
+            self._reset()
+
+    def __len__(self):
+        return len(self._files)
+
+    def __str__(self):
+        s = '<H5FilePool({} of {} files open)>'
+        return s.format(len(self), self.maxfiles)
+
+    __repr__ = __str__
+
+
+# the pool used by `LazyAccessH5` and `H5ArraySource`.
+h5pool = H5FilePool()
+
+
 class LazyAccessH5(LazyAccess):
     '''
     This object only stores a reference to an hdf5 file including key and index.
@@ -84,12 +211,50 @@ class LazyAccessH5(LazyAccess):
         The key provided here will only be used, if no key was
         already given at object initialization.
         '''
-        # print('accessing')
-        import h5py
         k = key if self.key is None else self.key
-        h5group = h5py.File(self.filename, 'r')[k]
+        h5group = h5pool.dataset(self.filename, k)
         return h5group if self.index is None else h5group[self.index]
 
+    @classmethod
+    def accessbatch(cls, items):
+        '''
+        Items referring to the same dataset are read together. Contiguous indices
+        are combined into a single slice read and every item receives a view into
+        the data read.
+        '''
+        ret = [None] * len(items)
+        groups = collections.defaultdict(list)
+        for i, (la, shot, key) in enumerate(items):
+            if isinstance(la.index, (int, np.integer)) and la.index >= 0:
+                k = key if la.key is None else la.key
+                groups[(la.filename, k)].append(i)
+            else:
+                ret[i] = la.access(shot, key)
+        for (filename, k), idx in groups.items():
+            dset = h5pool.dataset(filename, k)
+            indices = np.array([items[i][0].index for i in idx])
+            order = np.argsort(indices, kind='stable')
+            # split the sorted indices into runs of consecutive indices
+            runs = np.split(order, np.nonzero(np.diff(indices[order]) > 1)[0] + 1)
+            for run in runs:
+                start = indices[run[0]]
+                block = dset[start:indices[run[-1]] + 1]
+                for j in run:
+                    ret[idx[j]] = block[indices[j] - start]
+        return ret
+
+    def storagekey(self, shot=None, key=None):
+        '''
+        returns `(filename, key, chunk, index)`, where `chunk` is the number of
+        the hdf5 chunk along the first axis containing `index`.
+        '''
+        k = key if self.key is None else self.key
+        if not isinstance(self.index, (int, np.integer)) or self.index < 0:
+            return (self.filename, k, 0, 0)
+        chunks = h5pool.dataset(self.filename, k).chunks
+        chunk = self.index // chunks[0] if chunks else 0
+        return (self.filename, k, int(chunk), int(self.index))
+
     def __str__(self):
         key = 'key' if self.key is None else "'{}'".format(self.key)
         s = "<LazyAccessH5@{file}[{key}][{idx}]>"
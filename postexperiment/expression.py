@@ -0,0 +1,382 @@
+#
+# This file is part of postexperiment.
+#
+# postexperiment is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# postexperiment is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with postexperiment. If not, see <http://www.gnu.org/licenses/>.
+'''
+Analysis and vectorized evaluation of the expressions used by the
+call interface of `Shot` and `ShotSeries`, e.g. `shotseries('a + np.sqrt(b)')`.
+
+An expression is vectorizable if it is an elementwise operation on its
+names only: arithmetics, single comparisons, bitwise operators and numpy ufuncs.
+Such an expression is evaluated once on arrays of all shots instead of on every
+shot individually, unless the results could differ:
+
+  * Python operators on booleans, e.g. `~flag` or `flag + flag`, act on
+    numbers in Python but are logical operations on boolean arrays
+    (see `boolsafe`).
+  * Floating point errors, e.g. a division by zero, raise an exception in
+    Python but result in `inf` or `nan` on arrays. `evaluate` raises a
+    `FloatingPointError` instead, such that the caller can fall back to the
+    evaluation on every shot.
+
+  * Integers are unbounded in Python but wrap around on arrays. Numexpr
+    returns `0` for the modulo and floor division by zero, integer powers with
+    negative exponents truncate to integers and `abs` converts integers to
+    floats. Hence, `intsafe` rejects `**`, `//`, `%`, `<<` and `abs` on integer
+    operands and any integer operation, which might overflow.
+
+`analyse` compiles an expression and resolves its aliases (see `Shot.alias`)
+once, such that no alias has to be looked up on evaluation. It also determines
+the names the expression depends on. The results are kept in an LRU cache
+shared by `Shot` and `ShotSeries`.
+'''
+
+import ast
+import builtins
+import functools
+
+import numpy as np
+
+__all__ = []
+
+
+_binops = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+           ast.LShift, ast.RShift, ast.BitOr, ast.BitXor, ast.BitAnd)
+_unaryops = (ast.UAdd, ast.USub, ast.Invert)
+_bitops = (ast.BitOr, ast.BitXor, ast.BitAnd)
+_cmpops = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def _isnpattr(node):
+    return isinstance(node, ast.Attribute) \
+        and isinstance(node.value, ast.Name) and node.value.id == 'np'
+
+
+def _isvectorizable(node):
+    '''
+    walks the ast and returns `True` if all nodes act elementwise.
+    '''
+    if isinstance(node, ast.Expression):
+        return _isvectorizable(node.body)
+    if isinstance(node, ast.Name):
+        return node.id != 'np'
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, (int, float, complex))
+    if isinstance(node, ast.BinOp):
+        return isinstance(node.op, _binops) \
+            and _isvectorizable(node.left) and _isvectorizable(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, _unaryops) and _isvectorizable(node.operand)
+    if isinstance(node, ast.Compare):
+        # chained comparisons `a < b < c` use `and` internally.
+        return len(node.ops) == 1 and isinstance(node.ops[0], _cmpops) \
+            and _isvectorizable(node.left) and _isvectorizable(node.comparators[0])
+    if isinstance(node, ast.Call):
+        if node.keywords:
+            return False
+        if _isnpattr(node.func):
+            ok = isinstance(getattr(np, node.func.attr, None), np.ufunc)
+        else:
+            ok = isinstance(node.func, ast.Name) and node.func.id == 'abs'
+        return ok and all(_isvectorizable(arg) for arg in node.args)
+    if _isnpattr(node):
+        # constants such as `np.pi`
+        return isinstance(getattr(np, node.attr, None), float)
+    return False
+
+
+@functools.lru_cache(maxsize=1024)
+def vectorizable_names(expr):
+    '''
+    returns the frozenset of names used in the expression `expr` if
+    it can be evaluated on whole arrays at once. Returns `None` otherwise.
+    '''
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except(SyntaxError):
+        return None
+    if not _isvectorizable(tree):
+        return None
+    return frozenset(node.id for node in ast.walk(tree)
+                     if isinstance(node, ast.Name) and node.id not in ('np', 'abs'))
+
+
+def _isbool(node, boolnames):
+    '''
+    returns `True` if the vectorizable `node` evaluates to booleans.
+    '''
+    if isinstance(node, ast.Name):
+        return node.id in boolnames
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, bool)
+    if isinstance(node, ast.Compare):
+        return True
+    if isinstance(node, ast.BinOp) and isinstance(node.op, _bitops):
+        return _isbool(node.left, boolnames) and _isbool(node.right, boolnames)
+    return False
+
+
+def boolsafe(expr, boolnames):
+    '''
+    returns `True` if the vectorizable expression `expr` gives the same results
+    on boolean arrays as on the Python booleans of every shot, given that the
+    names `boolnames` contain booleans. Python operators other than `&`, `|` and
+    `^` treat booleans as numbers, hence they are unsafe if all of their operands
+    are booleans.
+    '''
+    for node in ast.walk(ast.parse(expr, mode='eval')):
+        if isinstance(node, ast.BinOp) and not isinstance(node.op, _bitops):
+            if _isbool(node.left, boolnames) and _isbool(node.right, boolnames):
+                return False
+        if isinstance(node, ast.UnaryOp) and _isbool(node.operand, boolnames):
+            return False
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+                and any(_isbool(arg, boolnames) for arg in node.args):
+            # `abs`
+            return False
+    return True
+
+
+class _IntUnsafe(Exception):
+    pass
+
+
+_intunsafeops = (ast.Pow, ast.FloorDiv, ast.Mod, ast.LShift)
+
+
+def _intbound(node, bounds, limit):
+    '''
+    returns an upper bound of the absolute values of the vectorizable `node`, if it
+    evaluates to integers and `None` otherwise. Raises `_IntUnsafe` if the node or
+    any of its children could evaluate differently on arrays.
+    '''
+    if isinstance(node, ast.Name):
+        return bounds.get(node.id)
+    if isinstance(node, ast.Constant):
+        return abs(node.value) if isinstance(node.value, int) else None
+    if isinstance(node, ast.Compare):
+        _intbound(node.left, bounds, limit)
+        _intbound(node.comparators[0], bounds, limit)
+        return 1
+    if isinstance(node, ast.UnaryOp):
+        bound = _intbound(node.operand, bounds, limit)
+        if bound is None:
+            return None
+        ret = bound + 1 if isinstance(node.op, ast.Invert) else bound
+    elif isinstance(node, ast.BinOp):
+        left = _intbound(node.left, bounds, limit)
+        right = _intbound(node.right, bounds, limit)
+        if left is None or right is None:
+            return None
+        if isinstance(node.op, _intunsafeops):
+            raise _IntUnsafe()
+        if isinstance(node.op, ast.Div):
+            return None
+        if isinstance(node.op, ast.Mult):
+            ret = left * right
+        elif isinstance(node.op, ast.RShift):
+            ret = left
+        elif isinstance(node.op, _bitops):
+            ret = 2 * max(left, right)
+        else:
+            ret = left + right
+    elif isinstance(node, ast.Call):
+        args = [_intbound(arg, bounds, limit) for arg in node.args]
+        if not _isnpattr(node.func) and any(arg is not None for arg in args):
+            # `abs`
+            raise _IntUnsafe()
+        return None
+    else:
+        return None
+    if ret > limit:
+        raise _IntUnsafe()
+    return ret
+
+
+def intsafe(expr, bounds, limit=2**63 - 1):
+    '''
+    returns `True` if the vectorizable expression `expr` gives the same results
+    on integer arrays as on the Python integers of every shot. `bounds` maps the
+    names of integer (or boolean) arrays to the maximum of their absolute values
+    and `limit` is the largest integer the arrays can hold.
+    '''
+    try:
+        _intbound(ast.parse(expr, mode='eval').body, bounds, limit)
+    except(_IntUnsafe):
+        return False
+    return True
+
+
+def resolve_alias(key, alias):
+    '''
+    follows the chain of aliases starting at `key`.
+    '''
+    seen = set()
+    while key in alias and key not in seen:
+        seen.add(key)
+        key = alias[key]
+    return key
+
+
+class _AliasResolver(ast.NodeTransformer):
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def visit_Name(self, node):
+        node.id = resolve_alias(node.id, self.alias)
+        return node
+
+
+class CompiledExpression():
+    '''
+    An expression compiled by `analyse`.
+
+    attributes
+    ----------
+      code: the compiled code to be used with `eval`.
+      names: the names loaded from the namespace after alias resolution,
+        i.e. data keys and diagnostics. `np` and `self` are excluded.
+      required: the subset of `names`, which are evaluated unconditionally and
+        are not builtins. A shot lacking one of them cannot be evaluated.
+      aliases: dictionary mapping the aliases used to the resolved names.
+      usesnp: `True` if numpy is used.
+      scoped: `True` if the expression binds names itself, e.g. in a lambda or
+        a comprehension. The names used in the inner scopes are not analysed.
+    '''
+    __slots__ = ['expr', 'code', 'names', 'required', 'aliases', 'usesnp', 'scoped']
+
+    def __init__(self, expr, code, names, required, aliases, usesnp, scoped):
+        self.expr = expr
+        self.code = code
+        self.names = names
+        self.required = required
+        self.aliases = aliases
+        self.usesnp = usesnp
+        self.scoped = scoped
+
+    def diagnostics(self, registry):
+        '''
+        the names referring to diagnostics of `registry`.
+        '''
+        return frozenset(name for name in self.names if name in registry)
+
+    def datakeys(self, registry):
+        '''
+        the names which are not diagnostics of `registry`, i.e. the data keys.
+        '''
+        return frozenset(name for name in self.names if name not in registry)
+
+    def requiredkeys(self, registry):
+        '''
+        the data keys, which must be present to evaluate the expression.
+        '''
+        return frozenset(name for name in self.required if name not in registry)
+
+    def __repr__(self):
+        return '<CompiledExpression {!r} using {}>'.format(self.expr, sorted(self.names))
+
+
+_scopes = (ast.Lambda, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+def _outernames(node, conditional=False):
+    '''
+    yields the tuples `(name, conditional)` for all names evaluated in the namespace
+    of the expression. `conditional` is `True`, if the evaluation of the name depends
+    on a condition, e.g. `b` in `a or b`.
+    '''
+    if isinstance(node, _scopes):
+        # the first iterable of a comprehension is evaluated outside
+        if not isinstance(node, ast.Lambda):
+            yield from _outernames(node.generators[0].iter, conditional)
+        return
+    if isinstance(node, ast.Name):
+        yield node.id, conditional
+        return
+    if isinstance(node, ast.IfExp):
+        yield from _outernames(node.test, conditional)
+        yield from _outernames(node.body, True)
+        yield from _outernames(node.orelse, True)
+        return
+    if isinstance(node, ast.BoolOp):
+        yield from _outernames(node.values[0], conditional)
+        for value in node.values[1:]:
+            yield from _outernames(value, True)
+        return
+    if isinstance(node, ast.Compare) and len(node.ops) > 1:
+        # chained comparisons stop early
+        yield from _outernames(node.left, conditional)
+        yield from _outernames(node.comparators[0], conditional)
+        for comparator in node.comparators[1:]:
+            yield from _outernames(comparator, True)
+        return
+    for child in ast.iter_child_nodes(node):
+        yield from _outernames(child, conditional)
+
+
+def analyse(expr, alias):
+    '''
+    compiles the expression `expr` for evaluation with a `Shot` as
+    the local namespace and returns a `CompiledExpression`. All names used in the
+    expression are replaced by the keys they are aliases for in the mapping `alias`.
+    The results are cached.
+    '''
+    return _analyse(expr, tuple(sorted(alias.items())))
+
+
+def compile_expr(expr, alias):
+    '''
+    same as `analyse(expr, alias).code`.
+    '''
+    return _analyse(expr, tuple(sorted(alias.items()))).code
+
+
+@functools.lru_cache(maxsize=1024)
+def _analyse(expr, aliasitems):
+    alias = dict(aliasitems)
+    tree = ast.parse(expr, mode='eval')
+    scoped = any(isinstance(node, _scopes) for node in ast.walk(tree))
+    outer = list(_outernames(tree))
+    aliases = {name: resolve_alias(name, alias) for name, _ in outer if name in alias}
+    if aliases and not scoped:
+        tree = _AliasResolver(alias).visit(tree)
+        code = compile(tree, '<string>', 'eval')
+    else:
+        # nothing to resolve or the expression binds its own names.
+        code = compile(expr, '<string>', 'eval')
+    names = frozenset(resolve_alias(name, alias) for name, _ in outer) - {'np', 'self'}
+    required = frozenset(resolve_alias(name, alias) for name, c in outer if not c) \
+        - {'np', 'self'} - set(dir(builtins))
+    usesnp = any(name == 'np' for name, _ in outer)
+    return CompiledExpression(expr, code, names, required, aliases, usesnp, scoped)
+
+
+def evaluate(expr, arrays):
+    '''
+    evaluates `expr` on the mapping `arrays` using numexpr if possible
+    and numpy otherwise. Raises a `FloatingPointError` on division by zero,
+    invalid operations and overflows.
+    '''
+    try:
+        import numexpr
+        ret = numexpr.evaluate(expr, local_dict=dict(arrays))
+        # numexpr does not report floating point errors
+        if ret.dtype.kind not in 'fc' or np.isfinite(ret).all():
+            return ret
+    except(Exception):
+        # numexpr is either not available or does not support this expression.
+        pass
+    with np.errstate(divide='raise', invalid='raise', over='raise'):
+        return eval(expr, {'np': np}, dict(arrays))
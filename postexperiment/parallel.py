@@ -0,0 +1,301 @@
+#
+# This file is part of postexperiment.
+#
+# postexperiment is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# postexperiment is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with postexperiment. If not, see <http://www.gnu.org/licenses/>.
+'''
+Parallel execution of diagnostics and expressions on many shots.
+
+A `ShotExecutor` owns a process pool, which is created once and reused for
+every call. Work is dispatched in chunks of shots, such that the pickling
+overhead is paid per chunk and not per shot. A Shot is pickled as its
+mapping, hence `LazyAccess` objects are transferred as references and the
+data is loaded inside the worker.
+
+Every `ShotSeries` uses its `executor` attribute or -- if that is `None` --
+the session wide executor returned by `get_executor`.
+
+Modules keeping state per process -- e.g. the permanent cache -- can register a
+worker hook with `register_workerhook` to report from the workers back to the
+calling process after every chunk.
+
+A `Prefetcher` overlaps the disk I/O of `LazyAccess` objects of upcoming shots
+with the evaluation of the current shot using a bounded thread pool.
+'''
+
+import os
+import atexit
+import itertools
+import threading
+import collections
+import concurrent.futures as cf
+
+from . import common
+
+__all__ = ['ShotExecutor', 'get_executor', 'set_executor', 'register_workerhook',
+           'Prefetcher']
+
+
+class _Skipped():
+    '''
+    placeholder for the result of an item, which raised one of the exceptions
+    to be skipped.
+    '''
+    pass
+
+
+_workerhooks = []
+
+
+def register_workerhook(hook):
+    '''
+    registers `hook`, which must provide the two methods `collect()` and `merge(report)`.
+    `hook.collect()` is called in the worker process after every chunk. It returns a
+    picklable report, which is passed to `hook.merge(report)` in the calling process.
+    The hook is pickled along with every chunk, hence it should be a module level class
+    with static methods.
+    '''
+    if hook not in _workerhooks:
+        _workerhooks.append(hook)
+    return hook
+
+
+def _runchunk(func, hooks, chunk, *args):
+    ret = func(chunk, *args)
+    return ret, [hook.collect() for hook in hooks]
+
+
+def _mapchunk(chunk, func, skip):
+    results = []
+    for item in chunk:
+        try:
+            results.append(func(item))
+        except skip:
+            results.append(_Skipped)
+    return results
+
+
+class ShotExecutor():
+    '''
+    A persistent process pool dispatching work in chunks.
+
+    kwargs
+    ------
+      max_workers=None:
+        number of worker processes. Defaults to the number of CPUs.
+
+      chunksize=None:
+        number of items per chunk. By default the items are split into about
+        4 chunks per worker, but at most 256 items per chunk.
+    '''
+
+    def __init__(self, max_workers=None, chunksize=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunksize = chunksize
+        self._pool = None
+        self._pid = None
+        # the state the workers have been started in. See `require`.
+        self._state = None
+
+    @property
+    def pool(self):
+        '''
+        the process pool. It is created on first use and recreated if it
+        broke or if this process has been forked.
+        '''
+        if self._pool is None or self._pid != os.getpid() \
+                or getattr(self._pool, '_broken', False):
+            self._pool = cf.ProcessPoolExecutor(max_workers=self.max_workers)
+            self._pid = os.getpid()
+            atexit.register(self.shutdown)
+        return self._pool
+
+    def require(self, state):
+        '''
+        makes sure, that the workers have been started in `state`. `state` can be
+        any comparable object describing what the workers inherit when they are forked,
+        e.g. the registered functions, which may be defined in `__main__` and hence
+        cannot be unpickled by workers started earlier. The pool is restarted if it
+        has been started in a different state.
+        '''
+        if self._pool is not None and self._state != state:
+            self.shutdown()
+        self._state = state
+
+    def shutdown(self, wait=True):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=wait)
+        self._pool = None
+
+    def _chunksize(self, n):
+        if self.chunksize is not None:
+            return self.chunksize
+        if n is None:
+            return 64
+        return max(1, min(256, -(-n // (4 * self.max_workers))))
+
+    def _chunks(self, items, n=None):
+        it = iter(items)
+        chunksize = self._chunksize(n)
+        while True:
+            chunk = list(itertools.islice(it, chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+    def submit_chunks(self, func, chunks, *args):
+        '''
+        calls `func(chunk, *args)` for every chunk in the pool and yields the
+        results in order. Only a bounded number of chunks is in flight at any time.
+        The reports of the worker hooks are merged before each result is yielded.
+        '''
+        pool = self.pool
+        hooks = tuple(_workerhooks)
+        pending = collections.deque()
+
+        def result():
+            ret, reports = pending.popleft().result()
+            for hook, report in zip(hooks, reports):
+                hook.merge(report)
+            return ret
+
+        for chunk in chunks:
+            pending.append(pool.submit(_runchunk, func, hooks, chunk, *args))
+            if len(pending) >= 2 * self.max_workers:
+                yield result()
+        while pending:
+            yield result()
+
+    def map(self, func, items, skip=(), n=None):
+        '''
+        applies `func` to all `items` and yields the tuples `(i, result)` in the order of
+        the items. Items for which `func` raises one of the exceptions `skip` are left out,
+        just like in serial evaluation. All other exceptions are reraised.
+        '''
+        n = len(items) if n is None and hasattr(items, '__len__') else n
+        results = self.submit_chunks(_mapchunk, self._chunks(items, n), func, tuple(skip))
+        i = 0
+        for chunk in results:
+            for result in chunk:
+                if result is not _Skipped:
+                    yield i, result
+                i += 1
+
+    def __getstate__(self):
+        # the pool cannot be pickled
+        return dict(max_workers=self.max_workers, chunksize=self.chunksize,
+                    _pool=None, _pid=None, _state=None)
+
+    def __str__(self):
+        s = '<ShotExecutor({} workers, {})>'
+        return s.format(self.max_workers, 'running' if self._pool else 'idle')
+
+    __repr__ = __str__
+
+
+_executor = None
+
+
+def get_executor():
+    '''
+    returns the session wide `ShotExecutor`. It is created on first use.
+    '''
+    global _executor
+    if _executor is None:
+        _executor = ShotExecutor()
+    return _executor
+
+
+def set_executor(executor):
+    '''
+    sets the session wide `ShotExecutor` and returns the previous one.
+    '''
+    global _executor
+    old = _executor
+    _executor = executor
+    return old
+
+
+class Prefetcher():
+    '''
+    Fetches data for upcoming items on a thread pool while the current item is
+    being processed.
+
+    kwargs
+    ------
+      depth=8:
+        maximum number of items fetched ahead. `ShotSeries` fetches batches
+        of `batchsize` shots as a single item.
+
+      maxbytes=None:
+        if given, no further items are fetched ahead while the fetched, but not yet
+        consumed, data exceeds `maxbytes`. At least one item is always fetched.
+
+      max_workers=4:
+        number of threads.
+
+      batchsize=16:
+        number of shots fetched together by `ShotSeries`. This allows `LazyAccess`
+        objects to combine their reads (see `LazyAccess.accessbatch`).
+    '''
+
+    def __init__(self, depth=8, maxbytes=None, max_workers=4, batchsize=16):
+        self.depth = depth
+        self.maxbytes = maxbytes
+        self.max_workers = max_workers
+        self.batchsize = batchsize
+
+    def iterate(self, items, fetch):
+        '''
+        yields the tuples `(item, fetch(item))` in the order of `items`, while
+        `fetch` is already running for the following items.
+        '''
+        lock = threading.Lock()
+        loaded = [0]
+
+        def task(item):
+            result = fetch(item)
+            nbytes = common.nbytes(result)
+            with lock:
+                loaded[0] += nbytes
+            return result, nbytes
+
+        it = iter(items)
+        pending = collections.deque()
+        pool = cf.ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while True:
+                while len(pending) < max(self.depth, 1) and (
+                        not pending or self.maxbytes is None or loaded[0] < self.maxbytes):
+                    try:
+                        item = next(it)
+                    except(StopIteration):
+                        break
+                    pending.append((item, pool.submit(task, item)))
+                if not pending:
+                    return
+                item, future = pending.popleft()
+                result, nbytes = future.result()
+                with lock:
+                    loaded[0] -= nbytes
+                yield item, result
+        finally:
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=False)
+
+    def __str__(self):
+        s = '<Prefetcher(depth={}, maxbytes={}, batchsize={}, {} threads)>'
+        return s.format(self.depth, self.maxbytes, self.batchsize, self.max_workers)
+
+    __repr__ = __str__
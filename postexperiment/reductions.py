@@ -0,0 +1,297 @@
+#
+# This file is part of postexperiment.
+#
+# postexperiment is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# postexperiment is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with postexperiment. If not, see <http://www.gnu.org/licenses/>.
+'''
+Streaming reductions over the results of many shots.
+
+A reducer accumulates one result after the other in place, such that only
+a constant amount of memory is needed, independent of the number of shots.
+Partial states, e.g. from different processes, can be combined with `merge`.
+
+Example:
+  r = Mean()
+  for image in shotseries('image'):
+      r.update(image)
+  r.result()
+'''
+
+import abc
+import copy
+
+import numpy as np
+from future.utils import with_metaclass
+
+__all__ = ['Reducer', 'Count', 'Sum', 'Mean', 'Variance', 'Std', 'Min', 'Max',
+           'Percentile']
+
+
+class Reducer(with_metaclass(abc.ABCMeta, object)):
+    '''
+    The Reducer interface. Subclasses implement `_update`, `_merge` and `_result`.
+
+    If the reduced data are namedtuples, the result is returned as the same
+    namedtuple type.
+    '''
+
+    def __init__(self):
+        self.n = 0
+        self._resulttype = None
+
+    def fresh(self):
+        '''
+        returns an empty reducer of the same kind.
+        '''
+        return type(self)(**self._params())
+
+    def _params(self):
+        return dict()
+
+    def update(self, x):
+        '''
+        adds a single item `x` to the reduction.
+        '''
+        if self.n == 0 and isinstance(x, tuple) and type(x) is not tuple:
+            # will get here for namedtuples
+            self._resulttype = type(x)
+        self._update(np.asarray(x))
+        self.n += 1
+        return self
+
+    def merge(self, other):
+        '''
+        merges the partial state `other` into `self`.
+        '''
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.__dict__.update(copy.deepcopy(other.__dict__))
+            return self
+        self._merge(other)
+        self.n += other.n
+        return self
+
+    def result(self):
+        if self.n == 0:
+            raise ValueError('{} of empty data.'.format(type(self).__name__))
+        ret = np.asarray(self._result())[()]
+        if self._resulttype is not None:
+            return self._resulttype(*ret)
+        return ret
+
+    @abc.abstractmethod
+    def _update(self, x):
+        pass
+
+    @abc.abstractmethod
+    def _merge(self, other):
+        pass
+
+    @abc.abstractmethod
+    def _result(self):
+        pass
+
+    def __repr__(self):
+        return '<{} of {} items>'.format(type(self).__name__, self.n)
+
+
+class Count(Reducer):
+
+    def _update(self, x):
+        pass
+
+    def _merge(self, other):
+        pass
+
+    def result(self):
+        return self.n
+
+    _result = result
+
+
+class Sum(Reducer):
+
+    def _update(self, x):
+        if self.n == 0:
+            self.sum = np.array(x, copy=True)
+        elif np.can_cast(x.dtype, self.sum.dtype):
+            self.sum += x
+        else:
+            self.sum = self.sum + x
+
+    def _merge(self, other):
+        self.sum = self.sum + other.sum
+
+    def _result(self):
+        return self.sum
+
+
+class Mean(Reducer):
+    '''
+    The running mean (Welford).
+    '''
+
+    def _update(self, x):
+        if self.n == 0:
+            self.mean = np.array(x, dtype=np.result_type(x, 1.0), copy=True)
+        else:
+            self.mean += (x - self.mean) / (self.n + 1)
+
+    def _merge(self, other):
+        n = self.n + other.n
+        self.mean += (other.mean - self.mean) * (other.n / n)
+
+    def _result(self):
+        return self.mean
+
+
+class Variance(Mean):
+    '''
+    The running variance (Welford). Partial states are merged following
+    Chan et al.
+    '''
+
+    def __init__(self, ddof=0):
+        super().__init__()
+        self.ddof = ddof
+
+    def _params(self):
+        return dict(ddof=self.ddof)
+
+    def _update(self, x):
+        if self.n == 0:
+            super()._update(x)
+            self.m2 = np.zeros_like(self.mean)
+        else:
+            delta = x - self.mean
+            self.mean += delta / (self.n + 1)
+            delta *= x - self.mean
+            self.m2 += delta
+
+    def _merge(self, other):
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta**2 * (self.n * other.n / n)
+        self.mean += delta * (other.n / n)
+
+    def _result(self):
+        return self.m2 / (self.n - self.ddof)
+
+
+class Std(Variance):
+
+    def _result(self):
+        return np.sqrt(super()._result())
+
+
+class Min(Reducer):
+
+    def _update(self, x):
+        if self.n == 0:
+            self.min = np.array(x, copy=True)
+        else:
+            self.min = np.minimum(self.min, x)
+
+    def _merge(self, other):
+        self.min = np.minimum(self.min, other.min)
+
+    def _result(self):
+        return self.min
+
+
+class Max(Reducer):
+
+    def _update(self, x):
+        if self.n == 0:
+            self.max = np.array(x, copy=True)
+        else:
+            self.max = np.maximum(self.max, x)
+
+    def _merge(self, other):
+        self.max = np.maximum(self.max, other.max)
+
+    def _result(self):
+        return self.max
+
+
+class Percentile(Reducer):
+    '''
+    Approximate percentiles `q` using a uniform reservoir sample as the sketch.
+    The result is exact as long as the reservoir holds all items reduced.
+
+    Unlike the other reducers, the memory needed is not the size of a single
+    item, but the size of all items in the reservoir. Its capacity is therefore
+    limited by `size` items as well as by `maxbytes`, such that e.g. only 18
+    images of 1000x1700 float64 are kept with the default `maxbytes`.
+    The fewer items are kept, the less accurate the percentiles.
+
+    kwargs
+    ------
+      size=1000:
+        the maximum number of items in the reservoir.
+
+      maxbytes=256e6:
+        the maximum memory used by the reservoir in bytes, determined by the size
+        of the first item. At least one item is kept. `None` for no limit.
+
+      seed=None:
+        the seed of the random sampling.
+    '''
+
+    def __init__(self, q, size=1000, maxbytes=256e6, seed=None):
+        super().__init__()
+        self.q = q
+        self.size = size
+        self.maxbytes = maxbytes
+        self.seed = seed
+        self.reservoir = []
+        self._rng = np.random.RandomState(seed)
+
+    def _params(self):
+        return dict(q=self.q, size=self.size, maxbytes=self.maxbytes, seed=self.seed)
+
+    @property
+    def capacity(self):
+        '''
+        the maximum number of items in the reservoir.
+        '''
+        if self.maxbytes is None or not self.reservoir:
+            return self.size
+        nbytes = max(self.reservoir[0].nbytes, 1)
+        return max(1, min(self.size, int(self.maxbytes // nbytes)))
+
+    def _update(self, x):
+        if len(self.reservoir) < self.capacity:
+            self.reservoir.append(np.array(x, copy=True))
+        else:
+            j = self._rng.randint(0, self.n + 1)
+            if j < self.capacity:
+                self.reservoir[j] = np.array(x, copy=True)
+
+    def _merge(self, other):
+        items = self.reservoir + other.reservoir
+        capacity = self.capacity if self.reservoir else other.capacity
+        if len(items) <= capacity:
+            self.reservoir = items
+            return
+        # every item represents `n / len(reservoir)` original items.
+        weights = np.concatenate(
+            [np.full(len(self.reservoir), self.n / len(self.reservoir)),
+             np.full(len(other.reservoir), other.n / len(other.reservoir))])
+        idx = self._rng.choice(len(items), size=capacity, replace=False,
+                               p=weights / weights.sum())
+        self.reservoir = [items[i] for i in idx]
+
+    def _result(self):
+        return np.percentile(np.stack(self.reservoir), self.q, axis=0)
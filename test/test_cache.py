@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+
+import os
+import glob
+import pickle
+import subprocess
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import postpic as pp
+import postexperiment as pe
+from postexperiment import cache
+
+
+def shotid(shot):
+    return shot['x']
+
+
+def square(shot, power=2):
+    square.calls += 1
+    return shot['x'] ** power
+
+
+square.calls = 0
+
+
+def image(shot):
+    image.calls += 1
+    return np.full((shot['x'], 100), shot['x'], dtype=np.float64)
+
+
+image.calls = 0
+
+
+def viahelper(shot):
+    return shot.hlp() + 1
+
+
+_moduledir = tempfile.mkdtemp()
+
+
+@cache.permanentcachedecorator(os.path.join(_moduledir, 'module'), shotid)
+def decorated(shot):
+    return shot['x'] + 1
+
+
+def tearDownModule():
+    shutil.rmtree(_moduledir)
+
+
+class TestPermanentCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmpdir, 'test')
+        square.calls = 0
+        # no write-behind, unless a test enables it
+        self.flushinterval = cache._PermanentCache.flushinterval
+        cache._PermanentCache.flushinterval = None
+
+    def tearDown(self):
+        cache._PermanentCache.flushinterval = self.flushinterval
+        cache._PermanentCache._filelock.clear()
+        shutil.rmtree(self.tmpdir)
+
+    def newcache(self, function=square, **kwargs):
+        cache._PermanentCache._filelock.clear()
+        decorator = cache.permanentcachedecorator(self.prefix, shotid, **kwargs)
+        return decorator(function)
+
+    def test_roundtrip(self):
+        c = self.newcache()
+        self.assertEqual([c(dict(x=x)) for x in range(5)], [0, 1, 4, 9, 16])
+        self.assertEqual(c(dict(x=3)), 9)
+        self.assertEqual(c(dict(x=3), power=3), 27)
+        self.assertEqual(square.calls, 6)
+        self.assertEqual(len(c.cachenew), 6)
+        self.assertEqual(c.save(), os.path.abspath(self.prefix + '_square.cache.sqlite'))
+        self.assertIsNone(c.save())
+        # a new session reads the entries on demand
+        c = self.newcache()
+        self.assertEqual(len(c.cache), 0)
+        self.assertEqual(len(c), 6)
+        self.assertEqual(c(dict(x=3), power=3), 27)
+        self.assertEqual(c(dict(x=4)), 16)
+        self.assertEqual(square.calls, 6)
+        self.assertEqual(len(c.cache), 2)
+        self.assertEqual(c.hits, 2)
+
+    def test_legacy(self):
+        _, fileglob = cache._PermanentCache._absfile(self.prefix, 'square')
+        legacy = fileglob.replace('*', 'host', 1).replace('*', '1')
+        with open(legacy, 'wb') as f:
+            pickle.dump((0.5, {(2, ()): 'old', (3, ('power',)): 27}), f)
+        c = self.newcache()
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c(dict(x=2)), 4)
+        self.assertEqual(c(dict(x=3), power=2), 9)
+        self.assertEqual(square.calls, 2)
+        c.gc()
+        self.assertEqual(glob.glob(fileglob), [])
+
+    def test_kwargs(self):
+        c = self.newcache()
+        self.assertEqual(c(dict(x=3), power=2), 9)
+        self.assertEqual(c(dict(x=3), power=3), 27)
+        self.assertEqual(c(dict(x=3), power=np.array(2)), 9)
+        self.assertEqual(c(dict(x=3), power=2, context=pe.common.DefaultContext()), 9)
+        self.assertEqual(square.calls, 3)
+        self.assertEqual(len(c.cachenew), 3)
+
+    def test_version(self):
+        def make(offset, scale=1):
+            def shifted(shot, factor=scale):
+                return helper(shot['x']) * factor + offset
+            return shifted
+
+        def helper(x):
+            return x
+        version = cache._codeversion(make(1))
+        self.assertEqual(cache._codeversion(make(1)), version)
+        self.assertNotEqual(cache._codeversion(make(2)), version)
+        self.assertNotEqual(cache._codeversion(make(1, scale=2)), version)
+
+        def helper(x):
+            return 2 * x
+        self.assertNotEqual(cache._codeversion(make(1)), version)
+        # defaults and closures by content
+        self.assertNotEqual(cache._codeversion(make({'a': 1})),
+                            cache._codeversion(make({'a': 2})))
+        self.assertEqual(cache._codeversion(make({'a': 1, 'b': {2, 3}})),
+                         cache._codeversion(make({'b': {3, 2}, 'a': 1})))
+        self.assertNotEqual(cache._codeversion(make(1, scale=[1, 2])),
+                            cache._codeversion(make(1, scale=[2, 1])))
+        # stale entries are removed
+        c = self.newcache(make(1))
+        self.assertEqual(c(dict(x=3)), 7)
+        c.save()
+        self.assertEqual(len(self.newcache(make(1))), 1)
+        c = self.newcache(make(5))
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c(dict(x=3)), 11)
+
+    def test_version_sessions(self):
+        script = '\n'.join([
+            'import types',
+            'import numpy as np',
+            'from postexperiment import cache',
+            "names = {'alpha', 'beta', 'gamma', 'delta'}",
+            'config = types.SimpleNamespace(names=set(names), array=np.arange(3))',
+            "def f(shot): return shot['x'] in names or shot['x'] in config.names",
+            'print(cache._codeversion(f))'])
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(cache.__file__)))
+        versions = set()
+        for seed in ('0', '1', '2', '3'):
+            env['PYTHONHASHSEED'] = seed
+            out = subprocess.check_output([sys.executable, '-c', script], env=env)
+            versions.add(out.strip())
+        self.assertEqual(len(versions), 1)
+
+    def test_writebehind(self):
+        cache._PermanentCache.flushinterval = 0.01
+        c = self.newcache()
+        try:
+            self.assertEqual([c(dict(x=x)) for x in range(100)], [x**2 for x in range(100)])
+            t0 = time.time()
+            while c.cachenew and time.time() - t0 < 10:
+                time.sleep(0.01)
+            self.assertEqual(len(c.cachenew), 0)
+        finally:
+            cache._PermanentCache.flushinterval = None
+            cache._PermanentCache._writer.join()
+        self.assertIsNone(c.save())
+        c = self.newcache()
+        self.assertEqual(len(c), 100)
+        self.assertEqual(c(dict(x=7)), 49)
+        self.assertEqual(square.calls, 100)
+
+    def test_parallel(self):
+        c = self.newcache()
+        c(dict(id=3, x=3))
+        c.save()
+        ss = pe.ShotSeries(('id', int))
+        ss.merge([dict(id=i, x=i) for i in range(20)])
+        ss.executor = pe.ShotExecutor(max_workers=2, chunksize=3)
+        pe.Shot._register_diagnostic_fromdict({'square': c})
+        try:
+            self.assertEqual(ss.sum('square', parallel=True), sum(x**2 for x in range(20)))
+            self.assertEqual(c.hits, 1)
+            self.assertEqual(c.n_exec, 20)
+            # the results of the workers are shared
+            self.assertEqual(len(c), 20)
+            self.assertEqual(ss.sum('square', parallel=True), sum(x**2 for x in range(20)))
+            self.assertEqual(c.hits, 21)
+            self.assertEqual(list(ss('square()')), [x**2 for x in range(20)])
+            self.assertEqual(c.hits, 41)
+            self.assertEqual(square.calls, 1)
+        finally:
+            del pe.Shot.diagnostics['square']
+            ss.executor.shutdown()
+
+    def test_version_registration(self):
+        # the diagnostics are resolved on first use
+        c = self.newcache(viahelper)
+        pe.Shot._register_diagnostic_fromdict({'hlp': square})
+        try:
+            self.assertEqual(c.version, cache._codeversion(viahelper))
+        finally:
+            del pe.Shot.diagnostics['hlp']
+        self.assertNotEqual(c.version, cache._codeversion(viahelper))
+
+    def test_attach(self):
+        pe.Shot._register_diagnostic_fromdict({'hlp': square})
+        try:
+            c = self.newcache(viahelper)
+            c.save()
+            c['key'] = 'value'
+            c.save()
+        finally:
+            del pe.Shot.diagnostics['hlp']
+        # a worker with a different registry of diagnostics
+        cache._PermanentCache._filelock.clear()
+        attached = pickle.loads(pickle.dumps(c))
+        self.assertIsNot(attached, c)
+        self.assertEqual(attached.version, c.version)
+        self.assertNotEqual(cache._codeversion(viahelper), c.version)
+        self.assertEqual(len(attached), 1)
+        self.assertEqual(attached['key'], 'value')
+
+    def test_parallel_decorated(self):
+        cache._PermanentCache._filelock[decorated.file] = decorated
+        self.assertIs(pickle.loads(pickle.dumps(decorated)), decorated)
+        ss = pe.ShotSeries(('id', int))
+        ss.merge([dict(id=i, x=i) for i in range(20)])
+        ss.executor = pe.ShotExecutor(max_workers=2, chunksize=3)
+        pe.Shot._register_diagnostic_fromdict({'decorated': decorated})
+        try:
+            self.assertEqual(ss.sum('decorated', parallel=True), sum(range(1, 21)))
+            self.assertEqual(decorated.n_exec, 20)
+            self.assertEqual(len(decorated), 20)
+        finally:
+            del pe.Shot.diagnostics['decorated']
+            ss.executor.shutdown()
+
+    def test_blobs(self):
+        image.calls = 0
+        c = self.newcache(image, blobsize=1000, maxbytes=10000)
+        self.assertEqual(c(dict(x=5)).shape, (5, 100))
+        c.save()
+        self.assertEqual(len(os.listdir(c.blobdir)), 1)
+        c = self.newcache(image, blobsize=1000, maxbytes=10000)
+        ret = c(dict(x=5))
+        self.assertIsInstance(ret.base.base, np.memmap)
+        self.assertFalse(ret.flags.writeable)
+        self.assertTrue(np.all(ret == 5))
+        self.assertEqual(image.calls, 1)
+        # 10 * 100 * 8 bytes exceed the budget together with the first blob
+        c(dict(x=10))
+        c.save()
+        self.assertEqual(len(c), 1)
+        self.assertEqual(len(os.listdir(c.blobdir)), 1)
+        c = self.newcache(image, blobsize=1000, maxbytes=10000)
+        self.assertEqual(c(dict(x=10)).shape, (10, 100))
+        c(dict(x=5))
+        self.assertEqual(image.calls, 3)
+
+    def test_blobs_noncontiguous(self):
+        c = self.newcache(image, blobsize=1000)
+        data, buffers = c._dumpvalue(dict(a=np.zeros((100, 100))[:, ::2], b=np.arange(3)))
+        self.assertEqual(len(buffers), 1)
+        self.assertLess(len(data), 1000)
+        ret = pickle.loads(data, buffers=buffers)
+        self.assertEqual(ret['a'].shape, (100, 50))
+        self.assertEqual(ret['b'].tolist(), [0, 1, 2])
+
+    def test_atime(self):
+        c = self.newcache(image, blobsize=1000)
+        c(dict(x=5))
+        c.save()
+        atime, = c.db.execute('SELECT atime FROM blobs').fetchone()
+        time.sleep(0.01)
+        # a session only reading
+        c = self.newcache(image, blobsize=1000)
+        c(dict(x=5))
+        self.assertEqual(len(c._touched), 1)
+        self.assertIsNone(c.save())
+        self.assertEqual(len(c._touched), 0)
+        self.assertGreater(c.db.execute('SELECT atime FROM blobs').fetchone()[0], atime)
+
+    def test_field(self):
+        def field(shot):
+            return pp.Field(np.ones((50, 40)) * shot['x'], name='test')
+        c = self.newcache(field, blobsize=1000)
+        self.assertEqual(c(dict(x=2)).matrix.sum(), 4000)
+        c.save()
+        c = self.newcache(field, blobsize=1000)
+        ret = c(dict(x=2))
+        self.assertEqual(ret.name, 'test')
+        self.assertEqual(ret.matrix.sum(), 4000)
+        self.assertEqual(c.hits, 1)
+        c.gc()
+        self.assertEqual(len(os.listdir(c.blobdir)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
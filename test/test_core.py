@@ -66,6 +66,11 @@ class TestShot(unittest.TestCase):
         self.sa.updatealias({'test': 'ab', 'ab':'a'})
         self.assertEqual(self.sa('test'), 1)
         self.assertEqual(self.sa('(test, b+c)'), (1, 5))
+        # aliases are resolved on compilation
+        exprc = pe.expression.compile_expr('test + b', pe.Shot.alias)
+        self.assertEqual(exprc.co_names, ('a', 'b'))
+        self.assertEqual(self.sa('(lambda t: t + 1)(test)'), 2)
+        self.assertEqual(self.sa['test'], 1)
 
     def test_pickle_LazyAccess(self):
         self.sa.update(x=pe.LazyAccessDummy(42, exceptonaccess=True))
@@ -108,6 +113,23 @@ class TestShot(unittest.TestCase):
         #shot['test'] = np.array([])
         #shot['test'] = np.array(np.nan)
 
+    def test_validmask(self):
+        values = ['a', 'unknown', None, 1, np.nan, np.float32('nan'), [], [1.0, 2.0],
+                  np.array(['N/A']), np.array([1, 2]), np.str_('?'), 0]
+        expected = [True, False, False, True, False, False, False, True,
+                    False, True, False, True]
+        self.assertEqual([pe.Shot._isvaliddata(v) for v in values], expected)
+        self.assertEqual(pe.Shot.validmask(values).tolist(), expected)
+        self.assertEqual(pe.Shot.validmask(np.array([1.0, np.nan])).tolist(), [True, False])
+        self.assertEqual(pe.Shot.validmask(np.array(['a', 'NA'])).tolist(), [True, False])
+        unknowncontent = pe.Shot.unknowncontent
+        try:
+            pe.Shot.unknowncontent = unknowncontent + [-1]
+            self.assertFalse(pe.Shot._isvaliddata(-1))
+            self.assertEqual(pe.Shot.validmask(np.array([1, -1])).tolist(), [True, False])
+        finally:
+            pe.Shot.unknowncontent = unknowncontent
+
     def test_diagnostic(self):
         pe.Shot.register_diagnostic(stupiddiag)
         self.assertEqual(self.sa.stupiddiag(), 4)
@@ -135,6 +157,35 @@ class TestDiagnostic(unittest.TestCase):
         pe.Shot.register_diagnostic(d)
         self.assertEqual(self.sa.stupiddiag(), 4)
 
+    def test_memo(self):
+        calls = []
+
+        def countingdiag(shot, scale=1):
+            calls.append(shot['id'])
+            return np.full(100, shot['a'] * scale)
+        pe.Shot._register_diagnostic_fromdict({'countingdiag': countingdiag})
+        memo = pe.MemoCache(pe.ShotSeries(('id', int)).ShotId, maxbytes=2000)
+        pe.Diagnostic.memo = memo
+        try:
+            shots = [pe.Shot(id=i, a=i) for i in range(3)]
+            self.assertEqual(shots[1]('countingdiag().sum() + countingdiag()[0]'), 101)
+            self.assertEqual(calls, [1])
+            shots[1].countingdiag(scale=2)
+            self.assertEqual(calls, [1, 1])
+            # explicit contexts bypass the cache
+            shots[1].countingdiag(context=pe.Context())
+            self.assertEqual(calls, [1, 1, 1])
+            for shot in shots:
+                shot.countingdiag()
+            info = memo.info()
+            # only two results fit into the cache
+            self.assertEqual((info.hits, info.misses, info.evictions), (1, 5, 3))
+            self.assertEqual(info.entries, 2)
+            self.assertLessEqual(info.nbytes, 2000)
+        finally:
+            pe.Diagnostic.memo = None
+            del pe.Shot.diagnostics['countingdiag']
+
 
 class TestShotSeries(unittest.TestCase):
 
@@ -175,6 +226,35 @@ class TestShotSeries(unittest.TestCase):
         shots = pickle.loads(ds)
         self.assertEqual(shots[5], self.shotseries[5])
 
+    def test_getitem(self):
+        ss = self.shotseries
+        self.assertEqual(ss[-1]['id'], 99)
+        self.assertEqual(ss[42]['id'], 42)
+        self.assertEqual(ss[ss.ShotId(ss[42])]['id'], 42)
+        self.assertRaises(IndexError, lambda: ss[100])
+
+    def test_slice(self):
+        ss = self.shotseries
+        view = ss[10:50:2]
+        self.assertTrue(isinstance(view, pe.ShotSeriesView))
+        self.assertEqual(list(view('id')), list(range(10, 50, 2)))
+        self.assertEqual(list(ss[::-1]('id')), list(range(99, -1, -1)))
+        self.assertEqual(list(ss[-3:]('id')), [97, 98, 99])
+        # views of views refer to the original series
+        self.assertEqual(list(view[-2:]('id')), [46, 48])
+        self.assertTrue(view[-1] in view)
+        self.assertFalse(ss[11] in view)
+        # the shots are shared
+        view[0]['sliced'] = True
+        self.assertTrue(ss[10]['sliced'])
+        self.assertRaises(TypeError, view.merge, [])
+        materialized = view.materialize()
+        self.assertFalse(isinstance(materialized, pe.ShotSeriesView))
+        self.assertEqual(list(materialized('id')), list(range(10, 50, 2)))
+        materialized.merge([self.createshot(500)])
+        self.assertEqual(len(materialized), 21)
+        self.assertEqual(len(ss), 100)
+
     def test_call(self):
         data = list(self.shotseries('id'))
         self.assertEqual(data, list(range(100)))
@@ -187,9 +267,278 @@ class TestShotSeries(unittest.TestCase):
         data = list(self.shotseries('sometimes_there + 5'))
         self.assertEqual(data, [91]*10)
 
+    def test_call_vectorized(self):
+        ss = self.shotseries
+        self.assertIsNotNone(ss._vectorized('a + np.sqrt(b * b)'))
+        data = list(ss('a + np.sqrt(b * b)'))
+        self.assertEqual(data, [i + 1 + abs(i - 1) for i in range(100)])
+        # per shot evaluation is used for diagnostics and other data
+        pe.Shot._register_diagnostic_fromdict({'stupiddiag': stupiddiag})
+        self.assertIsNone(ss._vectorized('stupiddiag()'))
+        self.assertIsNone(ss._vectorized('(a, b)'))
+        ss[3]['x'] = pe.LazyAccessDummy(42, exceptonaccess=True)
+        self.assertIsNone(ss._vectorized('x + a'))
+
     def test_filter(self):
         shots = self.shotseries.filter('id > 50')
         self.assertEqual(len(shots), 49)
 
+    def test_filter_lazy(self):
+        calls = []
+
+        def f(shot):
+            calls.append(shot)
+            return shot['id'] % 2 == 0
+        view = self.shotseries.filter(f).filter('id > 50').filterby(b=59).sortby('-id')
+        self.assertTrue(isinstance(view, pe.ShotSeriesView))
+        self.assertEqual(len(calls), 0)
+        self.assertEqual(list(view('id')), [60])
+        self.assertEqual(len(calls), 100)
+        view = self.shotseries.filter('id < 10').sortby('-id')
+        self.assertEqual(list(view('id')), list(range(9, -1, -1)))
+        view = pickle.loads(pickle.dumps(self.shotseries.filter('id < 10')))
+        self.assertEqual(len(view), 10)
+        mask = np.arange(100) % 10 == 0
+        view = pe.ShotSeriesView(self.shotseries, mask)
+        self.assertEqual(list(view('id')), list(range(0, 100, 10)))
+        self.assertEqual(len(view.materialize()), 10)
+
+    def test_sortby(self):
+        shots = self.shotseries.sortby('-id')
+        self.assertEqual(list(shots('id')), list(range(99, -1, -1)))
+
+    def test_groupby(self):
+        groups = list(self.shotseries.groupby('a'))
+        self.assertEqual(len(groups), 100)
+        self.assertEqual(groups[3][0], 4)
+        self.assertEqual(len(groups[3][1]), 1)
+
+    def test_groupby_alias(self):
+        ss = pe.ShotSeries.empty_like(self.shotseries)
+        ss.merge([dict(id=i, E=i % 2) for i in range(4)])
+        pe.Shot.alias['energy'] = 'E'
+        try:
+            groups = [(k, len(g)) for k, g in ss.groupby('energy')]
+            self.assertEqual(groups, [(0, 2), (1, 2)])
+            groups = [(k, len(g)) for k, g in ss.groupby('energy', 'id')]
+            self.assertEqual(groups[:2], [((0, 0), 1), ((0, 2), 1)])
+            self.assertRaises(KeyError, list, ss.groupby('nowhere'))
+        finally:
+            del pe.Shot.alias['energy']
+
+    def test_groupby_multiple(self):
+        ss = self.shotseries
+        ss['even'] = 1
+        groups = list(ss.groupby('even', 'a', lazy=True))
+        self.assertEqual([k for k, _ in groups[:2]], [(1, 1), (1, 2)])
+        self.assertTrue(isinstance(groups[0][1], pe.ShotSeriesView))
+        for i, shot in enumerate(ss):
+            shot['mod'] = i % 3
+            shot['kind'] = 'odd' if i % 2 else 2
+        groups = list(ss.groupby('mod', 'kind'))
+        self.assertEqual(len(groups), 6)
+        # 'odd' and 2 cannot be ordered
+        groups = dict(ss.groupby('kind'))
+        self.assertEqual(len(groups['odd']), 50)
+        self.assertEqual(list(groups[2]('id'))[:3], [0, 2, 4])
+
+    def test_groupby_unhashable(self):
+        ss = pe.ShotSeries.empty_like(self.shotseries)
+        ss.merge([dict(id=i, l=[i % 2], m=[i % 2] if i % 3 else 'x') for i in range(6)])
+        groups = [(k, list(g('id'))) for k, g in ss.groupby('l')]
+        self.assertEqual(groups, [([0], [0, 2, 4]), ([1], [1, 3, 5])])
+        # lists and strings cannot be ordered
+        groups = [(k, list(g('id'))) for k, g in ss.groupby('m')]
+        self.assertEqual(groups, [('x', [0, 3]), ([1], [1, 5]), ([0], [2, 4])])
+
+    def test_reductions(self):
+        pe.Shot._register_diagnostic_fromdict({'stupiddiag': stupiddiag})
+        self.shotseries['c'] = 0
+        a = np.arange(100) + 1
+        self.assertAlmostEqual(self.shotseries.mean('stupiddiag'), np.mean(a))
+        self.assertAlmostEqual(self.shotseries.std('stupiddiag'), np.std(a))
+        self.assertEqual(self.shotseries.max('stupiddiag'), 100)
+        self.assertEqual(self.shotseries.count('stupiddiag'), 100)
+        self.assertAlmostEqual(self.shotseries.mean('stupiddiag', parallel=True), np.mean(a))
+
+    def test_call_parallel(self):
+        ss = self.shotseries
+        ss.executor = pe.ShotExecutor(max_workers=2, chunksize=7)
+        for n in [33, 14, 92]:
+            ss[n]['sometimes_there'] = 86
+        expr = 'self["sometimes_there"] + id'
+        self.assertEqual(list(ss(expr, parallel=True)), list(ss(expr)))
+        pool = ss.executor.pool
+        self.assertEqual(list(ss('id', parallel=True)), list(range(100)))
+        self.assertTrue(ss.executor.pool is pool)
+        ss.executor.shutdown()
+
+    def test_parallel_closure(self):
+        def make(factor):
+            def scaled(shot):
+                return factor * shot['id']
+            return scaled
+        ss = self.shotseries
+        ss.executor = pe.ShotExecutor(max_workers=2, chunksize=7)
+        pe.Shot._register_diagnostic_fromdict({'scaled': make(3), 'lam': lambda shot: 1})
+        try:
+            self.assertEqual(ss.sum('scaled', parallel=True), 3 * 4950)
+            self.assertEqual(ss.sum('lam', parallel=True), 100)
+            self.assertEqual(list(ss('scaled() + lam()', parallel=True))[:3], [1, 4, 7])
+        finally:
+            del pe.Shot.diagnostics['scaled']
+            del pe.Shot.diagnostics['lam']
+            ss.executor.shutdown()
+
+    def test_parallel_late_diagnostic(self):
+        import sys
+        ss = self.shotseries
+        ss.executor = pe.ShotExecutor(max_workers=2, chunksize=7)
+        main = sys.modules['__main__']
+        # not vectorized, hence starts the workers
+        self.assertEqual(list(ss('self["id"]', parallel=True)), list(range(100)))
+
+        # defined after the workers have been started, hence unknown to them
+        def late_helper(shot):
+            return 2 * shot['id']
+        late_helper.__module__ = '__main__'
+        late_helper.__qualname__ = 'late_helper'
+        main.late_helper = late_helper
+        pe.Shot._register_diagnostic_fromdict({'late_helper': late_helper})
+        try:
+            self.assertEqual(ss.sum('late_helper', parallel=True), 9900)
+            self.assertEqual(list(ss('late_helper() + 1', parallel=True))[:3], [1, 3, 5])
+            # no restart without new diagnostics
+            pool = ss.executor.pool
+            self.assertEqual(list(ss('self["id"]', parallel=True)), list(range(100)))
+            self.assertIs(ss.executor.pool, pool)
+        finally:
+            del pe.Shot.diagnostics['late_helper']
+            del main.late_helper
+            ss.executor.shutdown()
+
+    def test_call_prefetch(self):
+        ss = self.shotseries[:10]
+        for i, shot in enumerate(ss):
+            shot['x'] = pe.LazyAccessDummy(i)
+        ss[3]['y'] = pe.LazyAccessDummy(3, exceptonaccess=True)
+        expected = list(ss('x.sum() + id'))
+        self.assertEqual(list(ss('x.sum() + id', prefetch=3)), expected)
+        prefetcher = pe.Prefetcher(depth=4, maxbytes=1)
+        self.assertEqual(list(ss('x.sum() + id', prefetch=prefetcher)), expected)
+        self.assertRaises(pe.datasources.lazyaccess._LazyAccessException,
+                          list, ss('x.sum() + y.sum()', prefetch=3))
+
+    def test_merge_columns(self):
+        ss = pe.ShotSeries.empty_like(self.shotseries)
+        ss.merge_columns({'id': np.arange(5), 'x': [1.0, np.nan, 3.0, 4.0, 5.0],
+                          'c': ['a', 'unknown', 'c', None, 'e']})
+        ref = pe.ShotSeries.empty_like(self.shotseries)
+        ref.merge([dict(id=0, x=1.0, c='a'), dict(id=1, x=np.nan, c='unknown'),
+                   dict(id=2, x=3.0, c='c'), dict(id=3, x=4.0, c=None),
+                   dict(id=4, x=5.0, c='e')])
+        self.assertEqual([dict(shot._mapping) for shot in ss],
+                         [dict(shot._mapping) for shot in ref])
+        # add data to existing shots and new shots at once
+        ss.merge_columns({'id': [3, 4, 5], 'x': [4.0, 5.0, 6.0], 'c': ['d', 'e', 'f']})
+        self.assertEqual(len(ss), 6)
+        self.assertEqual(ss[3]['c'], 'd')
+        self.assertEqual(ss[5]['x'], 6.0)
+        # duplicate ids are merged one after the other
+        ss.merge_columns({'id': [6, 6], 'x': [7.0, 7.0]}, nmax=2)
+        self.assertEqual(len(ss), 7)
+        # write once, read many
+        self.assertRaises(ValueError, ss.merge_columns, {'id': [0, 1], 'x': [9.0, 2.0]})
+        self.assertRaises(ValueError, ss.merge_columns, {'id': [2], 'c': ['x']})
+        self.assertRaises(KeyError, ss.merge_columns, {'x': [1.0]})
+
+    def test_update(self):
+        class Source():
+            def __init__(self):
+                self.shots = []
+
+            def poll(self, cursor=None):
+                cursor = 0 if cursor is None else cursor
+                return self.shots[cursor:], len(self.shots)
+        source = Source()
+        ss = pe.ShotSeries.empty_like(self.shotseries)
+        ss.sources['live'] = source
+        source.shots.extend(dict(id=i, x=float(i)) for i in range(5))
+        self.assertEqual(len(ss.update()), 5)
+        self.assertEqual(ss.track('xmean', pe.Mean(), '__call__', 'x'), 2.0)
+        source.shots.extend(dict(id=i, x=float(i)) for i in range(5, 10))
+        source.shots.append(dict(id=10))
+        new = ss.update()
+        self.assertEqual(len(new), 6)
+        self.assertEqual(len(ss), 11)
+        self.assertEqual(ss.tracked('xmean'), 4.5)
+        self.assertEqual(list(ss.watch(interval=0, timeout=0)), [])
+        # views neither share nor modify the sources and reductions of their parent
+        view = ss.filter(lambda shot: shot['id'] < 3)
+        self.assertEqual(view.sources, {})
+        self.assertRaises(TypeError, view.track, 'xsum', pe.Mean(), '__call__', 'x')
+        self.assertRaises(TypeError, view.update)
+        view.sources['other'] = source
+        self.assertEqual(list(ss.sources), ['live'])
+        self.assertEqual(list(ss._tracked), ['xmean'])
+
+    def test_grouped_mean(self):
+        pe.Shot._register_diagnostic_fromdict({'stupiddiag': stupiddiag})
+        for i, shot in enumerate(self.shotseries):
+            shot['c'] = 0
+            shot['mod'] = i % 3
+        keys, means = self.shotseries.grouped_mean('stupiddiag', ['mod'])
+        self.assertEqual(keys, [0, 1, 2])
+        self.assertAlmostEqual(means[0], np.mean(np.arange(0, 100, 3) + 1))
+        self.assertAlmostEqual(means[2], np.mean(np.arange(2, 100, 3) + 1))
+
+
+class TestShotSeriesColumnar(TestShotSeries):
+
+    def setUp(self):
+        self.shotlist = [self.createshot(i) for i in range(100)]
+        ss = pe.ShotSeries(('id', int), columnar=True)
+        ss.merge(self.shotlist)
+        self.shotseries = ss
+
+    def test_columns(self):
+        store = self.shotseries._shots
+        self.assertTrue(self.shotseries.columnar)
+        data, valid = store.column('a')
+        self.assertEqual(data.dtype, np.int64)
+        self.assertTrue(valid.all())
+        self.shotseries.merge([dict(id=200, c=pe.LazyAccessDummy(1, exceptonaccess=True))])
+        data, valid = store.column('c')
+        self.assertEqual(data.dtype, object)
+        self.assertEqual(valid.sum(), 1)
+        self.assertTrue(isinstance(self.shotseries[-1]._mapping['c'], pe.LazyAccess))
+
+    def test_upcast(self):
+        self.shotseries.merge([dict(id=300, a=0.5)])
+        data, valid = self.shotseries._shots.column('a')
+        self.assertEqual(data.dtype, np.float64)
+        self.assertEqual(self.shotseries[-1]['a'], 0.5)
+
+    def test_upcast_lossless(self):
+        ss = pe.ShotSeries(('id', int), columnar=True)
+        ss.merge([dict(id=0, big=1600000000123456789, flag=True, x=1)])
+        ss.merge([dict(id=1, big=0.5, flag=2, x=0.5)])
+        store = ss._shots
+        self.assertEqual(store.column('big')[0].dtype, object)
+        self.assertEqual(store.column('flag')[0].dtype, object)
+        self.assertEqual(store.column('x')[0].dtype, np.float64)
+        self.assertEqual(ss[0]['big'], 1600000000123456789)
+        self.assertIs(ss[0]['flag'], True)
+        self.assertEqual(ss[1]['flag'], 2)
+        ss.merge_columns({'id': [2], 'big': [3]})
+        self.assertEqual(ss[0]['big'], 1600000000123456789)
+        ss.merge([dict(id=3, huge=2**70), dict(id=4, huge=1)])
+        self.assertEqual(ss[3]['huge'], 2**70)
+
+    def test_pickle_row(self):
+        shot = pickle.loads(pickle.dumps(self.shotseries[7]))
+        self.assertEqual(type(shot._mapping), dict)
+        self.assertEqual(shot, self.shotseries[7])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+
+import os
+import re
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import h5py
+import postexperiment as pe
+
+
+class TestH5(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'data.h5')
+        np.random.seed(0)
+        self.energy = np.random.rand(20)
+        self.image = np.random.rand(20, 8, 6)
+        with h5py.File(self.filename, 'w') as h5:
+            h5['id'] = np.arange(20)
+            h5['energy'] = self.energy
+            h5['camera/image'] = self.image
+
+    def tearDown(self):
+        pe.h5pool.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_h5arraysource(self):
+        source = pe.H5ArraySource(self.filename, 'id')
+        self.assertEqual(len(source), 20)
+        self.assertEqual(source.validkeys, (['energy', 'id'], ['camera/image']))
+        shots = list(source())
+        self.assertEqual(len(shots), 20)
+        self.assertEqual(shots[3]['energy'], self.energy[3])
+        la = shots[3]['camera/image']
+        self.assertTrue(np.array_equal(la.access(None, 'camera/image'), self.image[3]))
+
+    def test_gencolumns(self):
+        source = pe.H5ArraySource(self.filename, 'id')
+        chunks = list(source.gencolumns(chunksize=7))
+        self.assertEqual([len(c['id']) for c in chunks], [7, 7, 6])
+        self.assertTrue(np.array_equal(np.concatenate([c['energy'] for c in chunks]),
+                                       self.energy))
+        rows = list(source.gendatadict(chunksize=7))
+        self.assertEqual([row['id'] for row in rows], list(range(20)))
+        self.assertEqual(rows, list(source.gendatadict(chunksize=None)))
+        self.assertEqual(source.gendatadict(12)['energy'], self.energy[12])
+        self.assertEqual(source.gendatadict(12)['camera/image'].index, 12)
+
+    def test_lazyaccessh5(self):
+        la = pe.LazyAccessH5(self.filename, key='camera/image', index=5)
+        self.assertTrue(np.array_equal(la.access(), self.image[5]))
+        self.assertTrue(np.array_equal(la.access(), self.image[5]))
+        self.assertEqual(len(pe.h5pool), 1)
+
+    def test_accessbatch(self):
+        indices = [3, 4, 5, 9, 0, 10, 4]
+        items = [(pe.LazyAccessH5(self.filename, index=i), None, 'camera/image')
+                 for i in indices]
+        items.append((pe.LazyAccessDummy(1), None, 'x'))
+        data = pe.accessbatch(items)
+        for i, d in zip(indices, data):
+            self.assertTrue(np.array_equal(d, self.image[i]))
+        self.assertTrue(np.array_equal(data[-1], np.random.RandomState(1).rand(1000, 1700)))
+
+    def test_prefetch_h5(self):
+        ss = pe.ShotSeries(('id', int))
+        ss.merge(pe.H5ArraySource(self.filename, 'id')())
+        pe.Shot.alias['img'] = 'camera/image'
+        try:
+            expected = list(ss('img.sum() + energy'))
+            prefetcher = pe.Prefetcher(depth=2, batchsize=6)
+            self.assertEqual(list(ss('img.sum() + energy', prefetch=prefetcher)), expected)
+        finally:
+            del pe.Shot.alias['img']
+
+    def test_chunkorder(self):
+        other = os.path.join(self.tmpdir, 'other.h5')
+        with h5py.File(other, 'w') as h5:
+            h5.create_dataset('camera/image', data=self.image, chunks=(4, 8, 6))
+        ss = pe.ShotSeries(('id', int))
+        ss.merge([{'id': i, 'img': pe.LazyAccessH5(fn, key='camera/image', index=i % 20)}
+                  for i, fn in enumerate([other, self.filename] * 20)])
+        la = ss[0]._mapping['img']
+        self.assertEqual(la.storagekey(), (other, 'camera/image', 0, 0))
+        self.assertEqual(ss[6]._mapping['img'].storagekey(), (other, 'camera/image', 1, 6))
+        order = ss._storageorder({'img'})
+        keys = [ss[int(i)]._mapping['img'].storagekey() for i in order]
+        self.assertEqual(keys, sorted(keys))
+        expected = list(ss('img.sum() + id'))
+        self.assertEqual(list(ss('img.sum() + id', chunkorder=True)), expected)
+        self.assertEqual(list(ss('img.sum() + id', chunkorder=True, parallel=True)),
+                         expected)
+
+    def test_poll(self):
+        filename = os.path.join(self.tmpdir, 'growing.h5')
+        with h5py.File(filename, 'w') as h5:
+            h5.create_dataset('id', data=np.arange(5), maxshape=(None,))
+        source = pe.H5ArraySource(filename, 'id')
+        shots, cursor = source.poll()
+        self.assertEqual([shot['id'] for shot in shots], list(range(5)))
+        shots, cursor = source.poll(cursor)
+        self.assertEqual(shots, [])
+        pe.h5pool.close()
+        with h5py.File(filename, 'a') as h5:
+            h5['id'].resize((8,))
+            h5['id'][5:] = [5, 6, 7]
+        shots, cursor = source.poll(cursor)
+        self.assertEqual([shot['id'] for shot in shots], [5, 6, 7])
+        self.assertEqual(cursor, 8)
+
+    def test_h5filepool(self):
+        pool = pe.H5FilePool(maxfiles=2)
+        filenames = []
+        for i in range(3):
+            filename = os.path.join(self.tmpdir, '{}.h5'.format(i))
+            with h5py.File(filename, 'w') as h5:
+                h5['x'] = np.arange(3) + i
+            filenames.append(filename)
+        for i, filename in enumerate(filenames):
+            self.assertEqual(pool.dataset(filename, 'x')[0], i)
+        self.assertEqual(len(pool), 2)
+        self.assertIs(pool.file(filenames[2]), pool.file(filenames[2]))
+        self.assertIs(pool.dataset(filenames[2], 'x'), pool.dataset(filenames[2], 'x'))
+        pool.close()
+        self.assertEqual(len(pool), 0)
+
+
+class TestRawReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'image.raw')
+        self.data = np.arange(3 * 4 * 5, dtype=np.uint16).reshape(4, 5, 3)
+        self.data.tofile(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_memmap(self):
+        reader = pe.RawReader('image', 5, 4, bands=3)
+        expected = reader(self.filename)
+        self.assertEqual(expected.matrix.dtype, np.float64)
+        self.assertEqual(expected.shape, (5, 4, 3))
+        self.assertTrue(np.array_equal(expected.matrix[:, ::-1, :],
+                                       np.swapaxes(self.data, 0, 1)))
+        field = reader(self.filename, memmap=True, asfloat=False)
+        self.assertEqual(field.matrix.dtype, np.uint16)
+        self.assertTrue(np.array_equal(field.matrix, expected.matrix))
+        # no copy of the data
+        self.assertFalse(field.matrix.flags.owndata)
+        # copy on write
+        field.matrix[0, 0, 0] = 1000
+        self.assertTrue(np.array_equal(np.fromfile(self.filename, dtype=np.uint16),
+                                       self.data.ravel()))
+
+
+class TestFileSource(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dirname = os.path.join(self.tmpdir, 'data')
+        for d in ['a', 'b', 'a/c']:
+            os.makedirs(os.path.join(self.dirname, d))
+        for fn in ['shot_1.png', 'a/shot_2.png', 'a/shot_x.png', 'a/c/shot_3.png',
+                   'b/shot_4.png', 'b/shot_5.pngtemp', 'b/other.txt']:
+            open(os.path.join(self.dirname, fn), 'w').close()
+        self.old = time.time() - 100
+        for root, dirs, files in os.walk(self.dirname):
+            os.utime(root, (self.old, self.old))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def source(self, **kwargs):
+        return pe.FileSource(self.dirname, r'shot_(\w+)\.png', 'image', {1: ('id', int)},
+                             **kwargs)
+
+    def walk(self):
+        # the reference implementation
+        ret = []
+        pattern = re.compile(r'shot_(\w+)\.png')
+        for root, dirs, files in os.walk(self.dirname):
+            for name in files:
+                match = pattern.match(name)
+                if name.endswith('temp') or not match:
+                    continue
+                try:
+                    shotid = int(match.group(1))
+                except ValueError:
+                    shotid = match.group(1)
+                ret.append((os.path.join(root, name), shotid))
+        return ret
+
+    def check(self, shots):
+        self.assertEqual([(shot['image'].filename, shot['id']) for shot in shots],
+                         self.walk())
+
+    def test_filesource(self):
+        shots = self.source()()
+        self.assertEqual(len(shots), 5)
+        self.check(shots)
+
+    def test_incremental(self):
+        manifest = os.path.join(self.tmpdir, 'manifest.pickle')
+        self.check(self.source(manifest=manifest)())
+        source = self.source(manifest=manifest)
+        scanned = []
+
+        def scandir(path, mtime):
+            scanned.append(path)
+            return pe.FileSource._scandir(source, path, mtime)
+        source._scandir = scandir
+        self.check(source())
+        self.assertEqual(scanned, [])
+        open(os.path.join(self.dirname, 'a', 'c', 'shot_6.png'), 'w').close()
+        self.check(source())
+        self.assertEqual(scanned, [os.path.join(self.dirname, 'a', 'c')])
+        self.assertEqual(len(source()), 6)
+
+    def test_poll(self):
+        source = self.source()
+        shots, cursor = source.poll()
+        self.check(shots)
+        self.assertEqual(source.poll(cursor)[0], [])
+        open(os.path.join(self.dirname, 'b', 'shot_7.png'), 'w').close()
+        shots, cursor = source.poll(cursor)
+        self.assertEqual([shot['id'] for shot in shots], [7])
+        ss = pe.ShotSeries(('id', str))
+        ss.sources['files'] = source
+        self.assertEqual(len(ss.update()), 6)
+        self.assertEqual(len(ss.update()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import unittest
+import numpy as np
+import postexperiment as pe
+from postexperiment import expression
+
+
+class TestAnalyse(unittest.TestCase):
+
+    def test_names(self):
+        c = expression.analyse('np.sum(image) + energy * diag(2)', {'energy': 'e'})
+        self.assertEqual(c.names, {'image', 'e', 'diag'})
+        self.assertEqual(c.aliases, {'energy': 'e'})
+        self.assertTrue(c.usesnp)
+        self.assertEqual(c.diagnostics({'diag': None}), {'diag'})
+        self.assertEqual(c.datakeys({'diag': None}), {'image', 'e'})
+        self.assertEqual(c.requiredkeys({'diag': None}), {'image', 'e'})
+        self.assertEqual(c.code.co_names, ('np', 'sum', 'image', 'e', 'diag'))
+
+    def test_required(self):
+        c = expression.analyse('a if b else c', {})
+        self.assertEqual(c.names, {'a', 'b', 'c'})
+        self.assertEqual(c.required, {'b'})
+        c = expression.analyse('x and y or z', {})
+        self.assertEqual(c.required, {'x'})
+        c = expression.analyse('len(x) + id', {})
+        self.assertEqual(c.names, {'len', 'x', 'id'})
+        self.assertEqual(c.required, {'x'})
+
+    def test_scoped(self):
+        c = expression.analyse('[v + w for v in x]', {'x': 'y'})
+        self.assertTrue(c.scoped)
+        self.assertEqual(c.names, {'y'})
+        self.assertEqual(c.code.co_names, ('x',))
+
+    def test_cache(self):
+        c = expression.analyse('a + b', {'a': 'c'})
+        self.assertIs(expression.analyse('a + b', {'a': 'c'}), c)
+        self.assertIsNot(expression.analyse('a + b', {}), c)
+
+    def test_skip_missing(self):
+        ss = pe.ShotSeries(('id', int))
+        ss.merge([dict(id=0, a=1), dict(id=1, b=2), dict(id=2, a=3, b=4)])
+        self.assertEqual(list(ss('a + b')), [7])
+        self.assertEqual(list(ss('a if a > 2 else b')), [3])
+        self.assertEqual(list(ss('b or a')), [2, 4])
+
+    def test_vectorized_bool(self):
+        ss = pe.ShotSeries(('id', int))
+        ss.merge([dict(id=0, flag=True, x=1.0), dict(id=1, flag=False, x=2.0)])
+        self.assertEqual(list(ss('~flag')), [-2, -1])
+        self.assertEqual(list(ss('flag + flag')), [2, 0])
+        self.assertEqual(list(ss('flag & (x > 1)')), [False, False])
+        self.assertFalse(expression.boolsafe('~flag', frozenset(['flag'])))
+        self.assertFalse(expression.boolsafe('(x > 1) - flag', frozenset(['flag'])))
+        self.assertTrue(expression.boolsafe('flag | (x > 1)', frozenset(['flag'])))
+        self.assertTrue(expression.boolsafe('flag + x', frozenset(['flag'])))
+        self.assertIsNotNone(ss._vectorized('flag ^ (x > 1)'))
+        self.assertIsNone(ss._vectorized('~flag'))
+
+    def test_vectorized_errors(self):
+        ss = pe.ShotSeries(('id', int))
+        ss.merge([dict(id=0, a=1, b=3), dict(id=1, a=2, b=4)])
+        self.assertRaises(FloatingPointError, expression.evaluate, 'a / (b - 3)',
+                          dict(a=np.array([1.0]), b=np.array([3.0])))
+        self.assertIsNone(ss._vectorized('a / (b - 3)'))
+        self.assertRaises(ZeroDivisionError, list, ss('a / (b - 3)'))
+        self.assertEqual(list(ss('a / (b - 2)')), [1, 1])
+
+    def test_vectorized_ints(self):
+        ss = pe.ShotSeries(('id', int))
+        ss.merge([dict(id=0, a=-3, b=0, n=1, x=2.0), dict(id=1, a=2**62, b=2, n=2, x=3.0)])
+        for expr in ('a % b', 'a // b', '2 ** -n', 'a ** n', 'abs(a)', '1 << a',
+                     'a + a', 'a * n', '-a * 2 > 0'):
+            self.assertIsNone(ss._vectorized(expr), expr)
+        self.assertRaises(ZeroDivisionError, list, ss('a % b'))
+        self.assertEqual(list(ss('2 ** -n')), [0.5, 0.25])
+        self.assertEqual(list(ss('a + a')), [-6, 2**63])
+        self.assertEqual([type(v) for v in ss('abs(a)')], [int, int])
+        for expr in ('a + n', 'n * b - a', 'a / n', 'x ** 2', 'a % x', 'n ** 0.5', 'a > n'):
+            self.assertIsNotNone(ss._vectorized(expr), expr)
+        self.assertEqual(list(ss('a + n')), [-2, 2**62 + 2])
+        self.assertFalse(expression.intsafe('a ** n', dict(a=2, n=2)))
+        self.assertTrue(expression.intsafe('a * n + 1', dict(a=2, n=2), limit=5))
+        self.assertFalse(expression.intsafe('a * n + 2', dict(a=2, n=2), limit=5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import unittest
+import collections
+import numpy as np
+import postexperiment as pe
+
+
+class TestReductions(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.data = np.random.rand(50, 4, 3)
+
+    def reduce(self, reducer, data):
+        for d in data:
+            reducer.update(d)
+        return reducer
+
+    def check(self, reducer, npfun):
+        r = self.reduce(reducer.fresh(), self.data)
+        self.assertTrue(np.allclose(r.result(), npfun(self.data, axis=0)))
+        # merging partial states gives the same result
+        r1 = self.reduce(reducer.fresh(), self.data[:17])
+        r2 = self.reduce(reducer.fresh(), self.data[17:])
+        self.assertTrue(np.allclose(r1.merge(r2).result(), npfun(self.data, axis=0)))
+        self.assertEqual(r1.n, 50)
+
+    def test_mean(self):
+        self.check(pe.Mean(), np.mean)
+
+    def test_var(self):
+        self.check(pe.Variance(), np.var)
+        self.check(pe.Std(), np.std)
+
+    def test_minmaxsum(self):
+        self.check(pe.Min(), np.min)
+        self.check(pe.Max(), np.max)
+        self.check(pe.Sum(), np.sum)
+
+    def test_count(self):
+        self.assertEqual(self.reduce(pe.Count(), self.data).result(), 50)
+        self.assertEqual(pe.Count().result(), 0)
+
+    def test_percentile(self):
+        self.check(pe.Percentile(30), lambda d, axis: np.percentile(d, 30, axis=axis))
+        r = self.reduce(pe.Percentile(50, size=100, seed=1), np.arange(10000))
+        self.assertEqual(len(r.reservoir), 100)
+        self.assertTrue(3000 < r.result() < 7000)
+
+    def test_percentile_maxbytes(self):
+        data = [np.full(100, i, dtype=np.float64) for i in range(50)]
+        r = self.reduce(pe.Percentile(50, maxbytes=8000, seed=1), data)
+        self.assertEqual(r.capacity, 10)
+        self.assertEqual(len(r.reservoir), 10)
+        self.assertEqual(r.result().shape, (100,))
+        other = self.reduce(pe.Percentile(50, maxbytes=8000, seed=2), data)
+        r.merge(other)
+        self.assertEqual(len(r.reservoir), 10)
+        # at least one item is kept
+        r = self.reduce(pe.Percentile(50, maxbytes=1), data)
+        self.assertEqual(len(r.reservoir), 1)
+        self.assertEqual(len(self.reduce(pe.Percentile(50, maxbytes=None), data).reservoir), 50)
+
+    def test_namedtuple(self):
+        Fit = collections.namedtuple('Fit', ['center', 'sigma'])
+        r = self.reduce(pe.Mean(), [Fit(1, 2), Fit(3, 4)])
+        self.assertEqual(r.result(), Fit(2, 3))
+
+    def test_empty(self):
+        self.assertRaises(ValueError, pe.Mean().result)
+
+
+if __name__ == '__main__':
+    unittest.main()